@@ -0,0 +1,282 @@
+import io, os, sys, gzip, json, time, random, shutil, hashlib, tarfile, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import zstandard as zstd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+from src import EXTRACT_WORKERS
+from src.extract import extract_package
+from src.mtree import verify
+
+# (files, smallest, largest) roughly like adwaita-icon-theme and python
+ARCHIVES = {"icon-theme": (20000, 256, 4096), "python": (8000, 1024, 64 * 1024)}
+
+WORKERS = (1, 4, 8, 16)
+
+RUNS = 3
+
+# Every tenth file is a symlink and every fiftieth a hardlink to the file before it
+SYMLINK_EVERY = 10
+HARDLINK_EVERY = 50
+
+# One in this many files differs between the two versions of an update
+UPDATE_CHANGED = 100
+
+
+def add_member(tar: tarfile.TarFile, name: str, type: bytes = tarfile.REGTYPE,
+               mode: int = 0o644, data: bytes = b"", linkname: str = "") -> None:
+    info = tarfile.TarInfo(name)
+    info.type = type
+    info.mode = mode
+    info.mtime = 1700000000
+    info.linkname = linkname
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data) if data else None)
+
+
+def build_mtree(members: List[Tuple[str, bytes, int, bytes, str]]) -> bytes:
+    lines = ["#mtree", "/set type=file uid=0 gid=0 mode=644"]
+    contents = {}
+
+    for name, type, mode, data, linkname in members:
+        if type == tarfile.DIRTYPE:
+            lines.append(f"./{name} time=1700000000.0 mode={mode:o} type=dir")
+        elif type == tarfile.SYMTYPE:
+            lines.append(f"./{name} time=1700000000.0 mode=777 type=link link={linkname}")
+        else:
+            # A hardlink is listed like the file it shares its data with
+            data = contents[name] = contents[linkname] if type == tarfile.LNKTYPE else data
+            lines.append(f"./{name} time=1700000000.0 mode={mode:o} size={len(data)} "
+                         f"sha256digest={hashlib.sha256(data).hexdigest()}")
+
+    return gzip.compress("\n".join(lines).encode() + b"\n")
+
+
+def build_archive(files: int, smallest: int, largest: int, changed: int = 0) -> bytes:
+    rng = random.Random(files)
+    buffer = io.BytesIO()
+    directories = set()
+    members = []
+
+    def add(name: str, type: bytes = tarfile.REGTYPE, mode: int = 0o644,
+            data: bytes = b"", linkname: str = "") -> None:
+        members.append((name, type, mode, data, linkname))
+
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        previous = mode = None
+
+        for i in range(files):
+            directory = f"usr/share/bench/{i % 16}x{i % 16}/{i % 7}"
+
+            # Parents come before their children, the order makepkg writes them in
+            parts = directory.split("/")
+            for depth in range(1, len(parts) + 1):
+                parent = "/".join(parts[:depth])
+
+                if parent not in directories:
+                    directories.add(parent)
+                    add(parent, type=tarfile.DIRTYPE, mode=0o755)
+
+            name = f"{directory}/file{i}"
+
+            if previous and i % SYMLINK_EVERY == 0:
+                add(name, type=tarfile.SYMTYPE, mode=0o777,
+                    linkname=os.path.relpath(previous, directory))
+            elif previous and i % HARDLINK_EVERY == 1:
+                add(name, type=tarfile.LNKTYPE, mode=mode, linkname=previous)
+            else:
+                size = rng.randint(smallest, largest)
+                data = rng.randbytes(size // 4 + 1) * 4
+
+                # The files a version bump touched, same size with different bytes
+                if i < changed:
+                    data = data[::-1]
+
+                mode = 0o755 if i % 3 == 0 else 0o644
+                add(name, mode=mode, data=data[:size])
+                previous = name
+
+        # What real packages ship and a filtered extraction would refuse or change
+        add("usr/share/bench/absolute", type=tarfile.SYMTYPE, mode=0o777,
+            linkname="/usr/share/icons/hicolor")
+        add("usr/share/bench/outside", type=tarfile.SYMTYPE, mode=0o777,
+            linkname="../../../../etc/os-release")
+        add("usr/share/bench/setuid", mode=0o4755, data=b"#!/bin/sh\n")
+
+        # The order makepkg writes them in, .MTREE ahead of the payload
+        add_member(tar, ".MTREE", data=build_mtree(members))
+        add_member(tar, ".PKGINFO", data=b"pkgname = bench\n")
+
+        for name, type, mode, data, linkname in members:
+            add_member(tar, name, type=type, mode=mode, data=data, linkname=linkname)
+
+    return zstd.ZstdCompressor().compress(buffer.getvalue())
+
+
+def extractall(path: str, destination: str) -> None:
+    with open(path, "rb") as fp:
+        with zstd.ZstdDecompressor().stream_reader(fp) as reader:
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                tar.extractall(destination, filter=getattr(tarfile, "fully_trusted_filter", None))
+
+
+def parallel(path: str, destination: str, workers: int, name: Optional[str] = None) -> None:
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        with open(path, "rb") as fp:
+            extract_package(fp, destination, pool, name)
+
+
+def update(old: str, new: str, destination: str) -> float:
+    shutil.rmtree(destination, ignore_errors=True)
+    os.makedirs(destination)
+
+    parallel(old, destination, EXTRACT_WORKERS, "bench")
+
+    start = time.perf_counter()
+    parallel(new, destination, EXTRACT_WORKERS, "bench")
+    elapsed = (time.perf_counter() - start) * 1000
+
+    checked, problems = verify(destination)
+
+    if not checked or problems:
+        raise RuntimeError(f"update of {destination} failed verification: {problems[:5]}")
+
+    return elapsed
+
+
+def snapshot(destination: str) -> Dict[str, Tuple]:
+    tree = {}
+    links = {}
+
+    for directory, names, files in os.walk(destination):
+        for name in names + files:
+            path = f"{directory}/{name}"
+            st = os.lstat(path)
+            relative = os.path.relpath(path, destination)
+
+            mtime = int(st.st_mtime)
+
+            # Neither sets the time of a symlink, it is whenever it was created
+            if os.path.islink(path):
+                content = os.readlink(path)
+                mtime = None
+            elif os.path.isdir(path):
+                content = None
+            else:
+                with open(path, "rb") as fp:
+                    content = fp.read()
+
+                if st.st_nlink > 1:
+                    links.setdefault(st.st_ino, []).append(relative)
+
+            tree[relative] = (st.st_mode, st.st_uid, st.st_gid, mtime, content)
+
+    # Hardlinked files have to end up sharing the same inode
+    for paths in links.values():
+        for path in paths:
+            tree[path] += (min(paths),)
+
+    return tree
+
+
+def measure(function, destination: str) -> float:
+    shutil.rmtree(destination, ignore_errors=True)
+    os.makedirs(destination)
+
+    start = time.perf_counter()
+    function(destination)
+    return (time.perf_counter() - start) * 1000
+
+
+def median(values: List[float]) -> float:
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main() -> None:
+    runs = RUNS
+    directory = None
+    output = None
+
+    argv = iter(sys.argv[1:])
+    for arg in argv:
+        match arg:
+            case "--runs":
+                runs = int(next(argv))
+            case "--directory":
+                directory = next(argv)
+            case "--output":
+                output = next(argv)
+            case _:
+                print(f"Usage: {sys.argv[0]} [--runs N] [--directory DIR] [--output FILE]")
+                sys.exit(1)
+
+    results = []
+
+    # The writes are what is measured, --directory picks the filesystem they land on
+    with tempfile.TemporaryDirectory(prefix="pharaoh-bench-", dir=directory) as path:
+        for name, (files, smallest, largest) in ARCHIVES.items():
+            archive = f"{path}/{name}.pkg.tar.zst"
+
+            with open(archive, "wb") as fp:
+                fp.write(build_archive(files, smallest, largest))
+
+            bumped = f"{path}/{name}-bumped.pkg.tar.zst"
+
+            with open(bumped, "wb") as fp:
+                fp.write(build_archive(files, smallest, largest, changed=files // UPDATE_CHANGED))
+
+            destination = f"{path}/out"
+
+            measure(lambda destination: extractall(archive, destination), destination)
+            expected = snapshot(destination)
+
+            result = {"archive": name, "files": files,
+                      "compressed_bytes": os.path.getsize(archive),
+                      "extractall_ms": median([
+                          measure(lambda destination: extractall(archive, destination), destination)
+                          for _ in range(runs)]),
+                      "parallel_ms": {}}
+
+            for workers in WORKERS:
+                samples = [measure(lambda destination: parallel(archive, destination, workers),
+                                   destination)
+                           for _ in range(runs)]
+
+                # The metadata is left out on purpose, everything else has to match extractall
+                tree = snapshot(destination)
+                expected.pop(".PKGINFO", None)
+                expected.pop(".MTREE", None)
+
+                if tree != expected:
+                    differences = sorted(path for path in tree.keys() | expected.keys()
+                                         if tree.get(path) != expected.get(path))[:5]
+                    raise RuntimeError(f"{name} with {workers} workers differs: {differences}")
+
+                result["parallel_ms"][workers] = median(samples)
+
+            result["update_ms"] = median([update(archive, bumped, destination)
+                                          for _ in range(runs)])
+            results.append(result)
+
+            best = min(result["parallel_ms"].values())
+            print(f"{name:>12}: extractall {result['extractall_ms']:8.2f} ms, "
+                  f"parallel {best:8.2f} ms ({result['extractall_ms'] / best:.2f}x), "
+                  f"update {result['update_ms']:8.2f} ms", file=sys.stderr)
+
+    data = {"python": sys.version.split()[0], "runs": runs, "cpus": os.cpu_count(),
+            "results": results}
+
+    if output:
+        with open(output, "w") as fp:
+            json.dump(data, fp, indent=4)
+    else:
+        print(json.dumps(data, indent=4))
+
+
+if __name__ == "__main__":
+    main()
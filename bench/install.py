@@ -0,0 +1,452 @@
+import io, os, sys, json, time, random, shutil, hashlib, tarfile, tempfile, threading, subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import zstandard as zstd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+from src.extract import extract_package
+
+# Number of packages in the dependency graph of the synthetic app
+GRAPHS = (10, 50, 200)
+
+RUNS = 3
+
+# Every package depends on this many others, the graph is a tree below the app
+FANOUT = 4
+
+FILES_PER_PACKAGE = 20
+FILE_SIZE = 32 * 1024
+
+VERSION = "1.0-1"
+TARGET = "bench-app"
+
+CHUNK_SIZE = 64 * 1024
+
+DESKTOP_ENTRY = f"""[Desktop Entry]
+Name=Bench
+Exec=/usr/bin/{TARGET} %U
+Type=Application
+Icon={TARGET}
+Terminal=false
+Categories=Utility;
+"""
+
+# Installs into the temporary tree, the patches happen before the modules
+# that read them are imported
+DRIVER = """import sys, json, time
+import src
+root, target, output = sys.argv[1:4]
+src.APPLICATION_DIRECTORY = f"{root}/app/"
+src.EXPORT_DIRECTORY = f"{root}/export/"
+src.SYNC_DIRECTORY = f"{root}/sync/"
+src.CACHE_DIRECTORY = f"{root}/cache/"
+src.STORE_DIRECTORY = f"{root}/store/"
+src.RUNTIME_DIRECTORY = f"{root}/runtime/"
+src.SECCOMP_DIRECTORY = f"{root}/seccomp/"
+src.MIRROR_SCORES = f"{root}/mirrors.json"
+src.STATE_DATABASE = f"{root}/state.db"
+src.PACMAN_LOCAL_DIRECTORY = f"{root}/local/"
+src.MIRRORLIST = f"{root}/mirrorlist"
+import src.fetch
+
+phases = {}
+
+def timed(name, function):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            phases[name] = phases.get(name, 0) + (time.perf_counter() - start) * 1000
+    return wrapper
+
+src.fetch.stage_etc = timed("stage_etc", src.fetch.stage_etc)
+src.fetch.generate_ld_cache = timed("ld_cache", src.fetch.generate_ld_cache)
+
+start = time.perf_counter()
+manager = src.fetch.PackageManager()
+phases["sync"] = (time.perf_counter() - start) * 1000
+
+manager.resolve = timed("resolve", manager.resolve)
+manager._download_packages = timed("download_extract", manager._download_packages)
+manager._export_package = timed("export", manager._export_package)
+manager._store.deduplicate = timed("dedup", manager._store.deduplicate)
+manager._install_package = timed("configure", manager._install_package)
+
+start = time.perf_counter()
+manager.install(target)
+phases["install"] = (time.perf_counter() - start) * 1000
+
+with open(output, "w") as fp:
+    json.dump(phases, fp)
+"""
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    root = None
+    latency = 0.0
+    bandwidth = None
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _range(self, size: int) -> Optional[range]:
+        value = self.headers.get("Range")
+
+        if not value or not value.startswith("bytes="):
+            return None
+
+        start, _, end = value[len("bytes="):].partition("-")
+        return range(int(start), min(int(end) + 1 if end else size, size))
+
+    def _send(self, body: bool) -> None:
+        # Every request pays the round trip, including the ones on a kept-alive connection
+        time.sleep(self.latency)
+
+        path = os.path.normpath(f"{self.root}/{self.path.split('?')[0]}")
+
+        if not path.startswith(self.root) or not os.path.isfile(path):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        size = os.path.getsize(path)
+        requested = self._range(size)
+
+        if requested is not None:
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {requested.start}-{requested.stop - 1}/{size}")
+        else:
+            self.send_response(200)
+            requested = range(0, size)
+
+        self.send_header("Content-Length", str(len(requested)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        if not body:
+            return
+
+        with open(path, "rb") as fp:
+            fp.seek(requested.start)
+            remaining = len(requested)
+
+            while remaining:
+                data = fp.read(min(CHUNK_SIZE, remaining))
+                self.wfile.write(data)
+                remaining -= len(data)
+
+                # The limit is per connection, like a mirror that caps every client
+                if self.bandwidth:
+                    time.sleep(len(data) / self.bandwidth)
+
+    def do_GET(self) -> None:
+        self._send(body=True)
+
+    def do_HEAD(self) -> None:
+        self._send(body=False)
+
+
+class Mirror:
+
+    def __init__(self, path: str, latency: float, bandwidth: Optional[float]) -> None:
+        handler = type("Handler", (MirrorHandler,),
+                       {"root": path, "latency": latency, "bandwidth": bandwidth})
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/$repo/os/$arch"
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def package_name(index: int) -> str:
+    return TARGET if index == 0 else f"bench-lib{index:04d}"
+
+
+def package_depends(index: int, count: int) -> List[str]:
+    children = range(index * FANOUT + 1, min(index * FANOUT + FANOUT + 1, count))
+    return [package_name(child) for child in children]
+
+
+def add_file(tar: tarfile.TarFile, name: str, data: bytes, mode: int = 0o644) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    info.mtime = 0
+    tar.addfile(info, io.BytesIO(data))
+
+
+def add_directory(tar: tarfile.TarFile, name: str) -> None:
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE
+    info.mode = 0o755
+    info.mtime = 0
+    tar.addfile(info)
+
+
+def build_package(name: str, depends: List[str], rng: random.Random) -> bytes:
+    buffer = io.BytesIO()
+
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        pkginfo = f"pkgname = {name}\npkgver = {VERSION}\narch = x86_64\n"
+        pkginfo += "".join(f"depend = {depend}\n" for depend in depends)
+        add_file(tar, ".PKGINFO", pkginfo.encode())
+
+        for directory in ("usr", "usr/lib", f"usr/lib/{name}"):
+            add_directory(tar, directory)
+
+        # A quarter of random data repeated, roughly the ratio of real binaries
+        for i in range(FILES_PER_PACKAGE):
+            add_file(tar, f"usr/lib/{name}/data{i}.bin", rng.randbytes(FILE_SIZE // 4) * 4)
+
+        if name == TARGET:
+            for directory in ("usr/bin", "usr/share", "usr/share/applications"):
+                add_directory(tar, directory)
+
+            add_file(tar, f"usr/bin/{name}", b"#!/bin/sh\n", mode=0o755)
+            add_file(tar, f"usr/share/applications/{name}.desktop", DESKTOP_ENTRY.encode())
+
+    return zstd.ZstdCompressor().compress(buffer.getvalue())
+
+
+def generate_repo(path: str, count: int) -> int:
+    rng = random.Random(count)
+    directory = f"{path}/core/os/x86_64"
+    os.makedirs(directory, exist_ok=True)
+
+    database = io.BytesIO()
+    size = 0
+
+    with tarfile.open(fileobj=database, mode="w:gz") as db:
+        for index in range(count):
+            name = package_name(index)
+            depends = package_depends(index, count)
+            filename = f"{name}-{VERSION}-x86_64.pkg.tar.zst"
+
+            data = build_package(name, depends, rng)
+            size += len(data)
+
+            with open(f"{directory}/{filename}", "wb") as fp:
+                fp.write(data)
+
+            desc = {"FILENAME": [filename], "NAME": [name], "VERSION": [VERSION],
+                    "ARCH": ["x86_64"], "CSIZE": [str(len(data))],
+                    "SHA256SUM": [hashlib.sha256(data).hexdigest()], "DEPENDS": depends}
+
+            text = "".join(f"%{key}%\n" + "\n".join(values) + "\n\n"
+                           for key, values in desc.items() if values)
+
+            add_directory(db, f"{name}-{VERSION}")
+            add_file(db, f"{name}-{VERSION}/desc", text.encode())
+
+    with open(f"{directory}/core.db", "wb") as fp:
+        fp.write(database.getvalue())
+
+    # The second repo exists but is empty, every sync still fetches it
+    os.makedirs(f"{path}/extra/os/x86_64", exist_ok=True)
+
+    with tarfile.open(f"{path}/extra/os/x86_64/extra.db", mode="w:gz"):
+        pass
+
+    return size
+
+
+class Bench:
+
+    def __init__(self, path: str, mirror: Mirror) -> None:
+        self._path = path
+        self._mirror = mirror
+
+        self.driver = f"{path}/driver.py"
+
+        with open(self.driver, "w") as fp:
+            fp.write(DRIVER)
+
+        self.env = dict(os.environ, PYTHONPATH=ROOT)
+        self.env.pop("SUDO_USER", None)
+
+    def create_root(self, name: str) -> str:
+        root = f"{self._path}/{name}"
+        shutil.rmtree(root, ignore_errors=True)
+
+        for directory in ("app", "export", "local", "runtime"):
+            os.makedirs(f"{root}/{directory}")
+
+        with open(f"{root}/mirrorlist", "w") as fp:
+            fp.write(f"Server = {self._mirror.url}\n")
+
+        return root
+
+    def install(self, root: str) -> Dict[str, float]:
+        output = f"{root}/phases.json"
+
+        if os.path.exists(output):
+            os.remove(output)
+
+        start = time.time()
+        result = subprocess.run([sys.executable, self.driver, root, TARGET, output],
+                                env=self.env, capture_output=True, text=True)
+        total = time.time() - start
+
+        if result.returncode != 0 or not os.path.exists(f"{root}/app/{TARGET}/{TARGET}.json"):
+            raise RuntimeError(result.stdout + result.stderr)
+
+        with open(output) as fp:
+            phases = json.load(fp)
+
+        phases["total"] = total * 1000
+        return phases
+
+    def reinstall(self, root: str) -> Dict[str, float]:
+        # Same state as an app that was removed, the package cache stays warm
+        shutil.rmtree(f"{root}/app/{TARGET}")
+        shutil.rmtree(f"{root}/export")
+        os.makedirs(f"{root}/export")
+
+        return self.install(root)
+
+
+def unpack_time(root: str) -> Tuple[float, float]:
+    decompressor = zstd.ZstdDecompressor()
+    scratch = f"{root}/scratch"
+    decompress = extract = 0
+
+    # One package after another, the install overlaps these with each other and the network
+    for entry in os.scandir(f"{root}/cache"):
+        if not entry.name.endswith(".pkg.tar.zst"):
+            continue
+
+        with open(entry.path, "rb") as fp:
+            start = time.perf_counter()
+
+            with decompressor.stream_reader(fp) as reader:
+                while reader.read(1024 * 1024):
+                    pass
+
+            decompress += time.perf_counter() - start
+
+        with open(entry.path, "rb") as fp:
+            start = time.perf_counter()
+            extract_package(fp, scratch)
+            extract += time.perf_counter() - start
+
+        shutil.rmtree(scratch)
+
+    return decompress * 1000, (extract - decompress) * 1000
+
+
+def median(values: List[float]) -> float:
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def summarize(samples: List[Dict]) -> Dict:
+    return {key: median([sample.get(key, 0) for sample in samples]) for key in samples[0]}
+
+
+def main() -> None:
+    graphs = GRAPHS
+    runs = RUNS
+    latency = 0.0
+    bandwidth = None
+    output = None
+
+    argv = iter(sys.argv[1:])
+    for arg in argv:
+        match arg:
+            case "--packages":
+                graphs = [int(count) for count in next(argv).split(",")]
+            case "--runs":
+                runs = int(next(argv))
+            case "--latency":
+                latency = float(next(argv)) / 1000
+            case "--bandwidth":
+                bandwidth = float(next(argv)) * 1024
+            case "--output":
+                output = next(argv)
+            case _:
+                print(f"Usage: {sys.argv[0]} [--packages N,N,...] [--runs N] "
+                      "[--latency MS] [--bandwidth KIB/S] [--output FILE]")
+                sys.exit(1)
+
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="pharaoh-bench-") as path:
+        for count in graphs:
+            repo = f"{path}/repo-{count}"
+            size = generate_repo(repo, count)
+
+            mirror = Mirror(repo, latency=latency, bandwidth=bandwidth)
+            mirror.start()
+
+            try:
+                bench = Bench(path, mirror)
+                cold, warm, unpack = [], [], []
+
+                for run in range(runs):
+                    root = bench.create_root(f"root-{count}")
+                    cold.append(bench.install(root))
+                    warm.append(bench.reinstall(root))
+                    unpack.append(unpack_time(root))
+            finally:
+                mirror.stop()
+
+            cold, warm = summarize(cold), summarize(warm)
+
+            # The warm install reads the cache, what it loses against the cold one
+            # is the transfer
+            decompress = median([sample[0] for sample in unpack])
+            extract = median([sample[1] for sample in unpack])
+
+            result = {
+                "packages": count,
+                "compressed_bytes": size,
+                "phases": {
+                    "sync_ms": cold["sync"],
+                    "resolve_ms": cold["resolve"],
+                    "download_ms": max(cold["download_extract"] - warm["download_extract"], 0),
+                    "decompress_ms": decompress,
+                    "extract_ms": extract,
+                    "export_ms": cold["export"],
+                },
+                "cold": cold,
+                "warm": warm,
+            }
+            results.append(result)
+
+            print(f"{count:>5} packages: cold {cold['install']:8.2f} ms, "
+                  f"warm {warm['install']:8.2f} ms, "
+                  f"download {result['phases']['download_ms']:8.2f} ms", file=sys.stderr)
+
+    data = {"python": sys.version.split()[0], "runs": runs,
+            "latency_ms": latency * 1000, "bandwidth_kib": bandwidth / 1024 if bandwidth else None,
+            "fanout": FANOUT, "files_per_package": FILES_PER_PACKAGE, "file_size": FILE_SIZE,
+            "results": results}
+
+    if output:
+        with open(output, "w") as fp:
+            json.dump(data, fp, indent=4)
+    else:
+        print(json.dumps(data, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import os, sys, json, time, shutil, signal, tempfile, subprocess
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+from src.etc import stage_etc
+
+# Number of files under etc/ and usr/ of every synthetic app
+SIZES = {"small": (10, 100), "medium": (100, 1000), "large": (1000, 5000)}
+
+RUNS = 5
+
+# bash has $EPOCHREALTIME, the stub can timestamp its start without forking
+BWRAP_STUB = """#!/bin/bash
+echo "$EPOCHREALTIME" > "$BENCH_RECORD"
+printf '%s\\0' "$@" >> "$BENCH_RECORD"
+"""
+
+# Reports readiness on --fd and exits once the other end is closed, like the real one
+PROXY_STUB = """#!{python} -S
+import os, sys, socket, select
+fd = int([arg for arg in sys.argv if arg.startswith("--fd=")][0][5:])
+sock = socket.socket(socket.AF_UNIX)
+sock.bind(sys.argv[2])
+os.write(fd, b"x")
+poll = select.poll()
+poll.register(fd, 0)
+poll.poll()
+"""
+
+# Runs `pharaoh run` against the temporary tree, the patches happen before
+# the modules that read them are imported
+DRIVER = """import sys
+import src
+src.APPLICATION_DIRECTORY = sys.argv[1]
+src.SECCOMP_DIRECTORY = sys.argv[2]
+import src.launch, src.proxy
+src.launch.BWRAP = sys.argv[3]
+src.proxy.XDG_DBUS_PROXY = sys.argv[4]
+from src.commands import run
+run.main([sys.argv[5]])
+"""
+
+MOUNT_OPTIONS = ("--bind", "--bind-try", "--ro-bind", "--ro-bind-try", "--dev-bind",
+                 "--dev-bind-try", "--tmpfs", "--dev", "--proc", "--ro-overlay")
+
+
+class Bench:
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+
+        self.app_directory = f"{path}/app"
+        self.seccomp_directory = f"{path}/seccomp"
+        self.runtime_dir = f"{path}/runtime"
+        self.record = f"{path}/record"
+
+        for directory in (self.app_directory, self.runtime_dir, f"{path}/home"):
+            os.makedirs(directory, exist_ok=True)
+
+        self.bwrap = self._write_stub("bwrap", BWRAP_STUB)
+        self.proxy = self._write_stub("xdg-dbus-proxy", PROXY_STUB.format(python=sys.executable))
+        self.driver = self._write_stub("driver.py", DRIVER)
+
+        self.env = dict(os.environ,
+                        PYTHONPATH=ROOT,
+                        XDG_RUNTIME_DIR=self.runtime_dir,
+                        DBUS_SESSION_BUS_ADDRESS=f"unix:path={path}/bus",
+                        WAYLAND_DISPLAY="wayland-0",
+                        HOME=f"{path}/home",
+                        USER="bench",
+                        BENCH_RECORD=self.record)
+        self.env.pop("SUDO_USER", None)
+
+        # Warm launches should hit the bytecode cache like they do on a real system
+        self.env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+    def _write_stub(self, name: str, content: str) -> str:
+        path = f"{self._path}/{name}"
+
+        with open(path, "w") as fp:
+            fp.write(content)
+
+        os.chmod(path, 0o755)
+        return path
+
+    def create_app(self, name: str, etc_files: int, usr_files: int,
+                   dbus: bool, staged: bool) -> None:
+        app_dir = f"{self.app_directory}/{name}"
+
+        for i in range(etc_files):
+            os.makedirs(f"{app_dir}/etc/{name}/{i % 10}", exist_ok=True)
+
+            with open(f"{app_dir}/etc/{name}/{i % 10}/{i}.conf", "w") as fp:
+                fp.write(f"option{i}=1\n")
+
+        for directory in ("bin", "lib", "share"):
+            os.makedirs(f"{app_dir}/usr/{directory}", exist_ok=True)
+
+        for i in range(usr_files):
+            with open(f"{app_dir}/usr/lib/lib{name}{i}.so", "w") as fp:
+                fp.write("\n")
+
+        with open(f"{app_dir}/usr/bin/{name}", "w") as fp:
+            fp.write("#!/bin/sh\n")
+
+        if staged:
+            stage_etc(app_dir)
+
+        config = {
+            "app": name,
+            "path": app_dir,
+            "icon": name,
+            "executable": f"{app_dir}/usr/bin/{name}",
+            "entry": f"{name}.desktop",
+            "permissions": {"dri": True, "ipc": False, "dbus": dbus, "downloads": False,
+                            "home": False, "pulseaudio": True, "pipewire": True},
+            "seccomp_filter": None,
+            "seccomp": {"presets": ["default"]},
+            "dbus_app": f"org.Pharaoh.{name}",
+            "dbus_permissions": {"notifications": True, "screencast": False,
+                                 "screenshot": False},
+            "runtimes": [],
+        }
+
+        with open(f"{app_dir}/{name}.json", "w") as fp:
+            json.dump(config, fp, indent=4)
+
+    def forget_plan(self, name: str) -> None:
+        for path in (f"{self.app_directory}/{name}/{name}.plan.json",
+                     f"{self.runtime_dir}/pharaoh/{name}.plan.json"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def launch(self, name: str) -> Dict:
+        command = [sys.executable, "-S", "-X", "importtime", self.driver,
+                   self.app_directory, self.seccomp_directory, self.bwrap, self.proxy, name]
+
+        start = time.time()
+        result = subprocess.run(command, env=self.env, capture_output=True, text=True)
+        total = time.time() - start
+
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr)
+
+        with open(self.record) as fp:
+            started, _, argv = fp.read().partition("\n")
+
+        argv = argv.split("\0")[:-1]
+
+        return {
+            "time_to_exec_ms": (float(started) - start) * 1000,
+            "total_ms": total * 1000,
+            "import_ms": import_time(result.stderr) / 1000,
+            "argv_length": len(argv),
+            "mounts": sum(1 for arg in argv if arg in MOUNT_OPTIONS),
+            "syscalls": self._syscalls(command),
+        }
+
+    def _syscalls(self, command: List[str]) -> Optional[int]:
+        strace = shutil.which("strace")
+
+        if not strace:
+            return None
+
+        output = f"{self._path}/strace"
+        subprocess.run([strace, "-f", "-c", "-o", output] + command,
+                       env=self.env, capture_output=True)
+
+        with open(output) as fp:
+            for line in fp:
+                if line.strip().endswith("total"):
+                    return int(line.split()[3 if len(line.split()) > 5 else 2])
+
+        return None
+
+    def stop_proxies(self) -> None:
+        directory = f"{self.runtime_dir}/xdg-dbus-proxy"
+
+        if not os.path.isdir(directory):
+            return
+
+        for name in os.listdir(directory):
+            if not name.endswith(".pid"):
+                continue
+
+            with open(f"{directory}/{name}") as fp:
+                try:
+                    os.kill(int(fp.read()), signal.SIGKILL)
+                except (ValueError, ProcessLookupError):
+                    pass
+
+
+def import_time(stderr: str) -> int:
+    total = 0
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+
+        # Top level imports only, everything else is part of their cumulative time
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            total += int(cumulative)
+
+    return total
+
+
+def median(values: List[float]) -> float:
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def summarize(samples: List[Dict]) -> Dict:
+    summary = {}
+
+    for key in samples[0]:
+        values = [sample[key] for sample in samples if sample[key] is not None]
+        summary[key] = median(values) if values else None
+
+    return summary
+
+
+def main() -> None:
+    runs = RUNS
+    output = None
+
+    argv = iter(sys.argv[1:])
+    for arg in argv:
+        match arg:
+            case "--runs":
+                runs = int(next(argv))
+            case "--output":
+                output = next(argv)
+            case _:
+                print(f"Usage: {sys.argv[0]} [--runs N] [--output FILE]")
+                sys.exit(1)
+
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="pharaoh-bench-") as path:
+        bench = Bench(path)
+
+        try:
+            for size, (etc_files, usr_files) in SIZES.items():
+                for staged in (False, True):
+                    for dbus in (False, True):
+                        name = f"{size}{'-staged' if staged else ''}{'-dbus' if dbus else ''}"
+                        bench.create_app(name, etc_files, usr_files, dbus=dbus, staged=staged)
+
+                        cold = []
+                        for _ in range(runs):
+                            bench.stop_proxies()
+                            bench.forget_plan(name)
+                            cold.append(bench.launch(name))
+
+                        warm = [bench.launch(name) for _ in range(runs)]
+
+                        result = {"app": name, "etc_files": etc_files, "usr_files": usr_files,
+                                  "staged_etc": staged, "dbus": dbus,
+                                  "cold": summarize(cold), "warm": summarize(warm)}
+                        results.append(result)
+
+                        print(f"{name:>20}: cold {result['cold']['time_to_exec_ms']:7.2f} ms, "
+                              f"warm {result['warm']['time_to_exec_ms']:7.2f} ms, "
+                              f"{result['warm']['mounts']} mounts", file=sys.stderr)
+        finally:
+            bench.stop_proxies()
+
+    data = {"python": sys.version.split()[0], "runs": runs, "results": results}
+
+    if output:
+        with open(output, "w") as fp:
+            json.dump(data, fp, indent=4)
+    else:
+        print(json.dumps(data, indent=4))
+
+
+if __name__ == "__main__":
+    main()
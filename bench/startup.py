@@ -0,0 +1,61 @@
+import os, sys, subprocess
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules `pharaoh run` must never pull in
+FORBIDDEN = ("requests", "zstandard", "tqdm", "tarfile", "urllib3", "asyncio", "src.fetch")
+
+# Cumulative import time budget for the launch path, in microseconds
+BUDGET = 50 * 1000
+
+
+# Everything `pharaoh run` may import, including the fallback without pharaohd
+MODULES = ("src.commands.run", "src.config", "src.launch")
+
+
+def import_times(modules: List[str]) -> Dict[str, int]:
+    result = subprocess.run(
+        [sys.executable, "-S", "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        cwd=ROOT, capture_output=True, text=True)
+
+    if result.returncode != 0:
+        print(result.stderr)
+        sys.exit(1)
+
+    times = {}
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def main() -> None:
+    times = import_times(MODULES)
+    failed = False
+
+    for name in times:
+        if name.split(".")[0] in FORBIDDEN or name in FORBIDDEN:
+            print(f"FAIL: the launch path imports {name}")
+            failed = True
+
+    # Modules imported earlier show up nested, so summing never counts twice
+    total = sum(times.get(module, 0) for module in MODULES)
+    print(f"{', '.join(MODULES)}: {total / 1000:.2f} ms")
+
+    if total > BUDGET:
+        print(f"FAIL: launch path imports take longer than {BUDGET / 1000:.0f} ms")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
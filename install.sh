@@ -11,5 +11,8 @@ mkdir -p /etc/pharaoh && cp -r bin src /etc/pharaoh
 echo "Copying pharaoh.sh to /etc/profile.d"
 cp ext/pharaoh.sh /etc/profile.d/pharaoh.sh
 
+echo "Copying pharaohd.service to /usr/lib/systemd/user"
+cp ext/pharaohd.service /usr/lib/systemd/user/pharaohd.service
+
 echo "Symlinking pharaoh binary"
 ln -sf /etc/pharaoh/bin/pharaoh /usr/bin/pharaoh
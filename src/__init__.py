@@ -1,12 +1,26 @@
-from os import makedirs, environ
-from pathlib import Path
+from os import makedirs, environ, path
 
 ARCH = "x86_64"
 REPOS = ["core", "extra"]
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_SEGMENTS = 4
+EXTRACT_WORKERS = 8
+CACHE_SIZE_LIMIT = 4 * 1024 * 1024 * 1024
+DEDUP_METHOD = "hardlink"
+DBUS_PROXY_IDLE_TIMEOUT = 5 * 60
 
 APPLICATION_DIRECTORY = "/var/lib/pharaoh/app/"
 EXPORT_DIRECTORY = "/var/lib/pharaoh/export/"
-APPLICATION_HOME_DIRECTORY = f"/home/{environ['SUDO_USER']}/.var/app" if environ.get('SUDO_USER') else Path("~/.var/app").expanduser()
+SYNC_DIRECTORY = "/var/lib/pharaoh/sync/"
+CACHE_DIRECTORY = "/var/lib/pharaoh/cache/"
+STORE_DIRECTORY = "/var/lib/pharaoh/store/"
+RUNTIME_DIRECTORY = "/var/lib/pharaoh/runtime/"
+SECCOMP_DIRECTORY = "/var/lib/pharaoh/seccomp/"
+MIRROR_SCORES = "/var/lib/pharaoh/mirrors.json"
+STATE_DATABASE = "/var/lib/pharaoh/state.db"
+PACMAN_LOCAL_DIRECTORY = "/var/lib/pacman/local/"
+MIRRORLIST = "/etc/pacman.d/mirrorlist"
+APPLICATION_HOME_DIRECTORY = f"/home/{environ['SUDO_USER']}/.var/app" if environ.get('SUDO_USER') else path.expanduser("~/.var/app")
 
 try:
     makedirs(APPLICATION_DIRECTORY, exist_ok=True)
@@ -0,0 +1,212 @@
+import os, json, fcntl, hashlib, tempfile
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+from src import CACHE_DIRECTORY, CACHE_SIZE_LIMIT
+
+if TYPE_CHECKING:
+    from src.fetch import Package
+
+BUFFER_SIZE = 1024 * 1024
+
+PART_SUFFIXES = (".part", ".segments", ".segments.tmp")
+
+
+class ChecksumError(Exception):
+    pass
+
+
+class CacheEntry:
+
+    def __init__(self, path: str, sha256sum: str) -> None:
+        self._path = path
+        self._sha256sum = sha256sum
+        self._digest = hashlib.sha256()
+
+        # A deterministic .part name lets an interrupted download resume
+        self._part = f"{path}.part"
+        self._resumable = True
+
+        fd = os.open(self._part, os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Somebody else is fetching the same file, use a private one
+            os.close(fd)
+            fd, self._part = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+            self._resumable = False
+
+        self._fp = os.fdopen(fd, "r+b", buffering=BUFFER_SIZE)
+
+        if self.segments is None:
+            while data := self._fp.read(BUFFER_SIZE):
+                self._digest.update(data)
+        else:
+            self._digest = None
+
+        self._offset = self._fp.tell()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    @property
+    def resumable(self) -> bool:
+        return self._resumable
+
+    @property
+    def segments(self) -> Optional[List[List[int]]]:
+        try:
+            with open(f"{self._part}.segments") as fp:
+                return json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save_segments(self, segments: List[List[int]]) -> None:
+        with open(f"{self._part}.segments.tmp", "w") as fp:
+            json.dump(segments, fp)
+
+        os.replace(f"{self._part}.segments.tmp", f"{self._part}.segments")
+
+    def allocate(self, size: int) -> None:
+        # Segments are written out of order, switch to hashing the file at commit
+        self._digest = None
+        self._fp.flush()
+        os.ftruncate(self._fp.fileno(), size)
+
+    def reset(self) -> None:
+        self._fp.seek(0)
+        self._fp.truncate()
+        self._remove_segments()
+
+        self._digest = hashlib.sha256()
+        self._offset = 0
+
+    def write(self, data: bytes) -> None:
+        self._fp.write(data)
+        self._digest.update(data)
+        self._offset += len(data)
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        os.pwrite(self._fp.fileno(), data, offset)
+
+    def _hexdigest(self) -> str:
+        if self._digest:
+            return self._digest.hexdigest()
+
+        with open(self._part, "rb") as fp:
+            return hashlib.file_digest(fp, "sha256").hexdigest()
+
+    def _remove_segments(self) -> None:
+        try:
+            os.remove(f"{self._part}.segments")
+        except FileNotFoundError:
+            pass
+
+    def commit(self) -> str:
+        self._fp.close()
+
+        digest = self._hexdigest()
+
+        if digest != self._sha256sum:
+            self.discard()
+            raise ChecksumError(
+                f"{os.path.basename(self._path).split('-', 1)[1]}: expected {self._sha256sum}, got {digest}")
+
+        os.chmod(self._part, 0o644)
+        os.replace(self._part, self._path)
+        self._remove_segments()
+        return self._path
+
+    def abort(self) -> None:
+        self._fp.close()
+
+        # Keep the data around for the next attempt unless nobody can find it again
+        if not self._resumable:
+            self.discard()
+
+    def discard(self) -> None:
+        self._fp.close()
+        self._remove_segments()
+
+        try:
+            os.remove(self._part)
+        except FileNotFoundError:
+            pass
+
+
+class PackageCache:
+
+    def __init__(self, path: str = CACHE_DIRECTORY,
+                 limit: int = CACHE_SIZE_LIMIT) -> None:
+        self._path = path
+        self._limit = limit
+
+        os.makedirs(self._path, exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _entry_path(self, package: "Package") -> str:
+        return f"{self._path}/{package.sha256sum}-{package.filename}"
+
+    def _entries(self) -> List[os.DirEntry]:
+        with os.scandir(self._path) as entries:
+            return [entry for entry in entries
+                    if entry.is_file() and not entry.name.endswith(PART_SUFFIXES)]
+
+    def get(self, package: "Package") -> Optional[str]:
+        if not package.sha256sum:
+            return None
+
+        path = self._entry_path(package)
+
+        try:
+            # The mtime doubles as the LRU timestamp
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return path
+
+    def open(self, package: "Package") -> Optional[CacheEntry]:
+        if not package.sha256sum:
+            return None
+
+        return CacheEntry(self._entry_path(package), package.sha256sum)
+
+    def evict(self) -> int:
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        size = sum(entry.stat().st_size for entry in entries)
+        freed = 0
+
+        while entries and size > self._limit:
+            entry = entries.pop(0)
+            size -= entry.stat().st_size
+            freed += entry.stat().st_size
+            os.remove(entry.path)
+
+        return freed
+
+    def clean(self) -> int:
+        freed = 0
+
+        for entry in self._entries():
+            freed += entry.stat().st_size
+            os.remove(entry.path)
+
+        return freed
+
+    def stats(self) -> Dict[str, int]:
+        entries = self._entries()
+
+        return {
+            "packages": len(entries),
+            "size": sum(entry.stat().st_size for entry in entries),
+            "limit": self._limit,
+        }
@@ -0,0 +1,54 @@
+import os, json, socket
+from typing import Dict, Optional
+
+from src.plan import launch_environment
+
+TIMEOUT = 10
+
+
+def daemon_socket_path() -> str:
+    return f"{os.environ['XDG_RUNTIME_DIR']}/pharaoh/pharaohd.sock"
+
+
+class DaemonError(Exception):
+    pass
+
+
+class DaemonClient:
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self._path = path or daemon_socket_path()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def available(self) -> bool:
+        return os.path.exists(self._path)
+
+    def request(self, data: Dict) -> Dict:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(TIMEOUT)
+            sock.connect(self._path)
+            sock.sendall(json.dumps(data).encode() + b"\n")
+
+            with sock.makefile("rb") as fp:
+                line = fp.readline()
+
+        if not line:
+            raise DaemonError("pharaohd closed the connection")
+
+        response = json.loads(line)
+
+        if "error" in response:
+            raise DaemonError(response["error"])
+
+        return response
+
+    def run(self, app: str) -> int:
+        # The app belongs on this terminal's display and session bus, not the daemon's
+        return self.request({"action": "run", "app": app,
+                             "environment": launch_environment(os.environ)})["pid"]
+
+    def status(self) -> Dict:
+        return self.request({"action": "status"})
@@ -0,0 +1,11 @@
+import os, sys
+
+# Every command lives in its own module so `pharaoh run` only imports what it needs
+COMMANDS = ("install", "update", "run", "remove", "list", "info", "owns", "cache",
+            "dedup", "runtime", "daemon", "verify")
+
+
+def require_root() -> None:
+    if os.geteuid() != 0:
+        print("You must be root")
+        sys.exit(1)
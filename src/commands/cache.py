@@ -0,0 +1,23 @@
+from typing import List
+
+from src.cache import PackageCache
+from src.commands import require_root
+
+
+def main(args: List[str]) -> None:
+    require_root()
+
+    package_cache = PackageCache()
+    action = args[0] if args else "stats"
+
+    match action:
+        case "clean":
+            freed = package_cache.clean()
+            print(f"Removed {freed / (1024 * 1024):.2f} MiB from the package cache")
+        case "stats":
+            stats = package_cache.stats()
+            print(f"Packages: {stats['packages']}")
+            print(f"Size: {stats['size'] / (1024 * 1024):.2f} MiB")
+            print(f"Limit: {stats['limit'] / (1024 * 1024):.2f} MiB")
+        case _:
+            print(f"Unknown cache action '{action}'")
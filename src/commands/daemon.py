@@ -0,0 +1,34 @@
+import sys, asyncio
+from typing import List
+
+from src.client import DaemonClient, DaemonError
+
+
+def status() -> None:
+    client = DaemonClient()
+
+    if not client.available():
+        print("pharaohd is not running")
+        sys.exit(1)
+
+    try:
+        response = client.status()
+    except (DaemonError, OSError) as e:
+        print(e)
+        sys.exit(1)
+
+    print(f"Cached plans: {', '.join(response['plans']) or 'none'}")
+    print(f"Sandboxes ({len(response['sandboxes'])}):")
+
+    for sandbox in response["sandboxes"]:
+        print(f"    {sandbox['app']} ({sandbox['pid']})")
+
+
+def main(args: List[str]) -> None:
+    if args[:1] == ["status"]:
+        status()
+        return
+
+    from src.daemon import LaunchDaemon
+
+    asyncio.run(LaunchDaemon().serve())
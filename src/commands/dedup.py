@@ -0,0 +1,24 @@
+import os
+from typing import List
+
+from src import APPLICATION_DIRECTORY
+from src.commands import require_root
+from src.runtime import Runtime
+from src.store import ObjectStore
+
+
+def main(args: List[str]) -> None:
+    require_root()
+
+    store = ObjectStore()
+
+    for app in sorted(os.listdir(APPLICATION_DIRECTORY)):
+        linked, saved = store.deduplicate(app, f"{APPLICATION_DIRECTORY}/{app}")
+        print(f"{app}: linked {linked} files, saved {saved / (1024 * 1024):.2f} MiB")
+
+    for runtime in Runtime.list():
+        linked, saved = store.deduplicate(runtime.ref, runtime.path)
+        print(f"{runtime.ref}: linked {linked} files, saved {saved / (1024 * 1024):.2f} MiB")
+
+    freed = store.collect()
+    print(f"Collected {freed / (1024 * 1024):.2f} MiB of unreferenced objects")
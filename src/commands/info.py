@@ -0,0 +1,35 @@
+import sys, time
+from typing import List
+
+from src.state import StateDatabase, StateError
+
+
+def main(args: List[str]) -> None:
+    try:
+        app = args[0]
+    except IndexError:
+        print("Please specify an application")
+        sys.exit(1)
+
+    try:
+        state = StateDatabase(readonly=True)
+        row = state.app(app)
+    except StateError:
+        row = None
+
+    if not row:
+        print(f"Application '{app}' is not installed")
+        sys.exit(1)
+
+    packages = state.packages(app)
+
+    print(f"Name: {row['name']}")
+    print(f"Package: {row['target']}")
+    print(f"Path: {row['path']}")
+    print(f"Installed: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['installed']))}")
+    print(f"Runtimes: {row['runtimes'].replace(',', ', ') or 'none'}")
+    print(f"Exports: {len(state.exports(app))}")
+    print(f"Packages ({len(packages)}):")
+
+    for package in packages:
+        print(f"    {package['name']} {package['version']} ({package['files']} files)")
@@ -0,0 +1,44 @@
+import sys
+from typing import List
+
+from src.commands import require_root
+from src.database import DatabaseError
+from src.fetch import PackageManager
+
+
+def main(args: List[str]) -> None:
+    require_root()
+
+    dry_run = False
+    runtimes = []
+    names = []
+
+    argv = iter(args)
+    for arg in argv:
+        if arg == "--dry-run":
+            dry_run = True
+        elif arg == "--runtime":
+            runtimes.append(next(argv, None))
+        else:
+            names.append(arg)
+
+    if None in runtimes:
+        print("Please specify a runtime name")
+        sys.exit(1)
+
+    try:
+        app = names[0]
+        print(f"Installing \x1b[91m{app}\x1b[0m!")
+
+        package_manager = PackageManager()
+    except IndexError:
+        print("Please specify an application to install")
+        sys.exit(1)
+    except DatabaseError as e:
+        print(e)
+        sys.exit(1)
+
+    try:
+        package_manager.install(app, dry_run=dry_run, runtimes=runtimes)
+    finally:
+        package_manager.close()
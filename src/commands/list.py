@@ -0,0 +1,27 @@
+import os
+from typing import List
+
+from src import APPLICATION_DIRECTORY
+from src.state import StateDatabase, StateError
+
+
+def main(args: List[str]) -> None:
+    try:
+        apps = StateDatabase(readonly=True).apps()
+    except StateError:
+        apps = []
+
+    for app in apps:
+        print(f"{app['name']} {app['version']} ({app['packages']} packages)")
+
+    recorded = {app["name"] for app in apps}
+
+    try:
+        names = sorted(os.listdir(APPLICATION_DIRECTORY))
+    except FileNotFoundError:
+        names = []
+
+    # Apps installed before the state database existed only have their config
+    for name in names:
+        if name not in recorded and os.path.exists(f"{APPLICATION_DIRECTORY}/{name}/{name}.json"):
+            print(f"{name} (not recorded)")
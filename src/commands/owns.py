@@ -0,0 +1,51 @@
+import os, sys
+from typing import List
+
+from src import APPLICATION_DIRECTORY, EXPORT_DIRECTORY
+from src.state import StateDatabase, StateError
+
+
+def main(args: List[str]) -> None:
+    try:
+        path = args[0]
+    except IndexError:
+        print("Please specify a path")
+        sys.exit(1)
+
+    try:
+        state = StateDatabase(readonly=True)
+    except StateError:
+        print("No applications are installed")
+        sys.exit(1)
+
+    path = os.path.normpath(path)
+    app = None
+
+    if path.startswith(EXPORT_DIRECTORY):
+        relative = path[len(EXPORT_DIRECTORY):]
+
+        apps = state.exporters(relative)
+
+        if not apps:
+            print(f"No application exports {path}")
+            sys.exit(1)
+
+        for app in apps:
+            print(f"{path} is exported by {app}")
+
+        return
+
+    if path.startswith(APPLICATION_DIRECTORY):
+        app, _, relative = path[len(APPLICATION_DIRECTORY):].partition("/")
+    else:
+        # Paths as the sandbox sees them, /usr/lib/... of every app
+        relative = path.lstrip("/")
+
+    owners = state.owners(relative, app=app)
+
+    if not owners:
+        print(f"No package owns {path}")
+        sys.exit(1)
+
+    for owner in owners:
+        print(f"{path} is owned by {owner['package']} {owner['version']} ({owner['app']})")
@@ -0,0 +1,31 @@
+import shutil
+from typing import List
+
+from src import APPLICATION_DIRECTORY, APPLICATION_HOME_DIRECTORY
+from src.commands import require_root
+from src.export import Exporter
+from src.state import StateDatabase
+from src.store import ObjectStore
+
+
+def main(args: List[str]) -> None:
+    require_root()
+
+    try:
+        app = args[0]
+        print(f"Removing \x1b[91m{app}\x1b[0m!")
+
+        # Dropped first so the desktop never sees links into a missing app
+        removed = Exporter().remove(app)
+        print(f"Removed {removed} exported files")
+
+        shutil.rmtree(f"{APPLICATION_DIRECTORY}/{app}")
+        StateDatabase().remove(app)
+
+        freed = ObjectStore().release(app)
+        print(f"Freed {freed / (1024 * 1024):.2f} MiB of shared files")
+
+        # Apps that were never launched have no home directory
+        shutil.rmtree(f"{APPLICATION_HOME_DIRECTORY}/{app}", ignore_errors=True)
+    except IndexError:
+        print("Please specify an application to remove")
@@ -0,0 +1,38 @@
+import sys
+from typing import List
+
+from src import APPLICATION_DIRECTORY
+from src.client import DaemonClient, DaemonError
+
+
+def main(args: List[str]) -> None:
+    try:
+        application = args[0]
+    except IndexError:
+        print("Please specify an application to run")
+        sys.exit(1)
+
+    print("Running app!")
+
+    client = DaemonClient()
+
+    # pharaohd already has the plan in memory, only fall back to launching
+    # ourselves when it is not running
+    if client.available():
+        try:
+            pid = client.run(application)
+            print(f"Started {application} with pid {pid}")
+            return
+        except DaemonError as e:
+            print(e)
+            sys.exit(1)
+        except OSError:
+            pass
+
+    from src.config import Config
+    from src.launch import SandboxLauncher
+
+    config_file_path = f"{APPLICATION_DIRECTORY}/{application}/{application}.json"
+    config = Config.from_config(config_file_path)
+
+    SandboxLauncher.from_config(config).exec()
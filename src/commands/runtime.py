@@ -0,0 +1,69 @@
+import os, sys
+from typing import List
+
+from src import APPLICATION_DIRECTORY
+from src.commands import require_root
+from src.config import Config
+from src.runtime import Runtime
+from src.store import ObjectStore
+
+
+def main(args: List[str]) -> None:
+    action = args[0] if args else "list"
+
+    if action != "list":
+        require_root()
+
+    match action:
+        case "install":
+            from src.database import DatabaseError
+            from src.fetch import PackageManager
+
+            dry_run = "--dry-run" in args[1:]
+            names = [arg for arg in args[1:] if arg != "--dry-run"]
+
+            if len(names) < 2:
+                print("Usage: pharaoh runtime install <name> <package>...")
+                sys.exit(1)
+
+            print(f"Installing runtime \x1b[91m{names[0]}\x1b[0m!")
+            try:
+                package_manager = PackageManager()
+            except DatabaseError as e:
+                print(e)
+                sys.exit(1)
+
+            try:
+                package_manager.install_runtime(names[0], names[1:], dry_run=dry_run)
+            finally:
+                package_manager.close()
+        case "remove":
+            try:
+                layer = Runtime(args[1])
+            except IndexError:
+                print("Please specify a runtime to remove")
+                sys.exit(1)
+
+            if not layer.exists():
+                print(f"Runtime '{layer.name}' is not installed")
+                sys.exit(1)
+
+            users = [
+                app for app in os.listdir(APPLICATION_DIRECTORY)
+                if os.path.exists(f"{APPLICATION_DIRECTORY}/{app}/{app}.json")
+                and layer.name in Config.from_config(
+                    f"{APPLICATION_DIRECTORY}/{app}/{app}.json").runtimes
+            ]
+
+            if users:
+                print(f"Runtime '{layer.name}' is still used by: {', '.join(users)}")
+                sys.exit(1)
+
+            layer.remove()
+            freed = ObjectStore().release(layer.ref)
+            print(f"Freed {freed / (1024 * 1024):.2f} MiB of shared files")
+        case "list":
+            for layer in Runtime.list():
+                print(layer.name)
+        case _:
+            print(f"Unknown runtime action '{action}'")
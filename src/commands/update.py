@@ -0,0 +1,29 @@
+import sys
+from typing import List
+
+from src.commands import require_root
+from src.database import DatabaseError
+from src.fetch import PackageManager
+
+
+def main(args: List[str]) -> None:
+    require_root()
+
+    dry_run = "--dry-run" in args
+    update_all = "--all" in args
+    names = [arg for arg in args if not arg.startswith("--")]
+
+    if not names and not update_all:
+        print("Please specify an application to update, or --all")
+        sys.exit(1)
+
+    try:
+        package_manager = PackageManager()
+    except DatabaseError as e:
+        print(e)
+        sys.exit(1)
+
+    try:
+        package_manager.update(None if update_all else names, dry_run=dry_run)
+    finally:
+        package_manager.close()
@@ -0,0 +1,40 @@
+import os, sys
+from typing import List
+
+from src import APPLICATION_DIRECTORY
+from src.mtree import verify
+from src.state import StateDatabase, StateError
+
+
+def main(args: List[str]) -> None:
+    try:
+        app = args[0]
+    except IndexError:
+        print("Please specify an application")
+        sys.exit(1)
+
+    try:
+        row = StateDatabase(readonly=True).app(app)
+    except StateError:
+        row = None
+
+    app_dir = row["path"] if row else f"{APPLICATION_DIRECTORY}{app}"
+
+    if not os.path.isdir(app_dir):
+        print(f"Application '{app}' is not installed")
+        sys.exit(1)
+
+    checked, problems = verify(app_dir)
+
+    if not checked:
+        print(f"No package metadata recorded for '{app}', reinstall it to verify")
+        sys.exit(1)
+
+    for package, path, problem in problems:
+        print(f"{package}: /{path}: {problem}")
+
+    if problems:
+        print(f"\x1b[91m{app}\x1b[0m: {len(problems)} of {checked} files failed verification")
+        sys.exit(1)
+
+    print(f"\x1b[91m{app}\x1b[0m: {checked} files verified")
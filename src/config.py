@@ -1,5 +1,5 @@
 import json
-from typing import Self, Optional
+from typing import Dict, List, Self, Optional
 
 from src.permissions import Permissions, DBusPermissions
 from src.desktop import DesktopEntry
@@ -15,18 +15,22 @@ class Config:
                  entry: str,
                  permissions: Permissions,
                  seccomp_filter: Optional[str] = None,
+                 seccomp: Optional[Dict] = None,
                  dbus_app: Optional[str] = None,
-                 dbus_permissions: Optional[DBusPermissions] = None) -> None:
+                 dbus_permissions: Optional[DBusPermissions] = None,
+                 runtimes: Optional[List[str]] = None) -> None:
         self.app = app
         self.path = path
         self.icon = icon
         self.executable = executable
         self.permissions = permissions
         self.seccomp_filter = seccomp_filter
+        self.seccomp = seccomp
         self.entry = entry
 
         self.dbus_app = dbus_app
         self.dbus_permissions = dbus_permissions
+        self.runtimes = runtimes or []
 
     @classmethod
     def from_config(cls, config: str) -> Self:
@@ -39,9 +43,11 @@ class Config:
                    entry=data['entry'],
                    permissions=Permissions.from_dict(data['permissions']),
                    seccomp_filter=data['seccomp_filter'],
+                   seccomp=data.get('seccomp'),
                    dbus_app=data['dbus_app'],
                    dbus_permissions=DBusPermissions.from_dict(
-                       data['dbus_permissions']))
+                       data['dbus_permissions']),
+                   runtimes=data.get('runtimes', []))
 
 
 class ConfigBuilder:
@@ -53,17 +59,21 @@ class ConfigBuilder:
                  entry: DesktopEntry,
                  permissions: Permissions,
                  seccomp_filter: Optional[str] = None,
+                 seccomp: Optional[Dict] = None,
                  dbus_app: Optional[str] = None,
-                 dbus_permissions: DBusPermissions = None) -> None:
+                 dbus_permissions: DBusPermissions = None,
+                 runtimes: Optional[List[str]] = None) -> None:
         self.app = app
         self.executable = executable
         self.path = path
         self.entry = entry
         self.permissions = permissions
         self.seccomp_filter = seccomp_filter
+        self.seccomp = seccomp
 
         self.dbus_app = dbus_app
         self.dbus_permissions = dbus_permissions or DBusPermissions(0)
+        self.runtimes = runtimes or []
 
     def build(self, path) -> None:
 
@@ -75,8 +85,10 @@ class ConfigBuilder:
             "entry": self.entry._entry,
             "permissions": self.permissions.permissions,
             "seccomp_filter": self.seccomp_filter,
+            "seccomp": self.seccomp,
             "dbus_app": self.dbus_app,
-            "dbus_permissions": self.dbus_permissions.permissions
+            "dbus_permissions": self.dbus_permissions.permissions,
+            "runtimes": self.runtimes
         }
 
         with open(path, "w") as fp:
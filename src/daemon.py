@@ -0,0 +1,225 @@
+import os, json, signal, asyncio
+from typing import Dict, List, Optional, Tuple
+
+from src import APPLICATION_DIRECTORY
+from src.client import daemon_socket_path
+from src.config import Config
+from src.launch import SandboxLauncher
+from src.plan import LAUNCH_ENVIRONMENT, LaunchPlan, launch_environment
+
+# How often cached plans are checked against the app directory
+WATCH_INTERVAL = 1
+
+
+class Sandbox:
+
+    def __init__(self, app: str, process: asyncio.subprocess.Process,
+                 dbus_app: Optional[str] = None) -> None:
+        self._app = app
+        self._process = process
+        self._dbus_app = dbus_app
+
+    @property
+    def app(self) -> str:
+        return self._app
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid
+
+    @property
+    def dbus_app(self) -> Optional[str]:
+        return self._dbus_app
+
+    def to_dict(self) -> Dict:
+        return {"app": self._app, "pid": self.pid, "dbus_app": self._dbus_app}
+
+
+class LaunchDaemon:
+
+    def __init__(self, path: Optional[str] = None,
+                 app_directory: str = APPLICATION_DIRECTORY) -> None:
+        self._path = path or daemon_socket_path()
+        self._app_directory = app_directory
+
+        # One plan per app and session, clients on another display get their own
+        self._plans: Dict[Tuple[str, Tuple], Tuple[SandboxLauncher, LaunchPlan]] = {}
+        self._sandboxes: Dict[int, Sandbox] = {}
+        self._tasks = set()
+
+    @property
+    def sandboxes(self) -> List[Sandbox]:
+        return list(self._sandboxes.values())
+
+    def _config_path(self, app: str) -> str:
+        return f"{self._app_directory}/{app}/{app}.json"
+
+    def _load(self, app: str, environ: Dict[str, str]) -> Tuple[SandboxLauncher, LaunchPlan]:
+        key = (app, tuple(environ.get(name) for name in LAUNCH_ENVIRONMENT))
+
+        if key not in self._plans:
+            launcher = SandboxLauncher.from_config(Config.from_config(self._config_path(app)),
+                                                   environ=environ)
+            self._plans[key] = (launcher, launcher.plan())
+
+        return self._plans[key]
+
+    def preload(self) -> None:
+        try:
+            apps = os.listdir(self._app_directory)
+        except FileNotFoundError:
+            return
+
+        for app in apps:
+            if not os.path.exists(self._config_path(app)):
+                continue
+
+            try:
+                self._load(app, launch_environment(os.environ))
+            except (OSError, KeyError, ValueError) as e:
+                print(f"Failed to load '{app}': {e}")
+
+    def _refresh(self) -> None:
+        for key, (launcher, plan) in list(self._plans.items()):
+            try:
+                # The key covers the config, the app and runtime generations
+                # and the environment, anything else means a recompile
+                if launcher._plan_key() == plan.key:
+                    continue
+            except FileNotFoundError:
+                pass
+
+            print(f"'{key[0]}' changed, dropping its launch plan")
+            del self._plans[key]
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            self._refresh()
+
+    async def spawn(self, app: str, environ: Dict[str, str]) -> Sandbox:
+        launcher, plan = self._load(app, environ)
+
+        # Taking the lease may start the proxy and wait for it, other clients keep
+        # being served meanwhile
+        loop = asyncio.get_running_loop()
+        command, pass_fds = await loop.run_in_executor(None, launcher._prepare, plan)
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, pass_fds=pass_fds, stdin=asyncio.subprocess.DEVNULL,
+                env=self._process_environment(environ))
+        finally:
+            # bwrap has its own copies now, the lease lives as long as the sandbox
+            for fd in pass_fds:
+                os.close(fd)
+
+        sandbox = Sandbox(app=app, process=process, dbus_app=plan.dbus_app)
+        self._sandboxes[sandbox.pid] = sandbox
+
+        task = asyncio.create_task(self._reap(sandbox, process))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        return sandbox
+
+    def _process_environment(self, environ: Dict[str, str]) -> Dict[str, str]:
+        # None of the daemon's own session may leak into the sandbox
+        env = {key: value for key, value in os.environ.items() if key not in LAUNCH_ENVIRONMENT}
+        env.update(environ)
+        return env
+
+    def _environment(self, request: Dict) -> Dict[str, str]:
+        environ = request.get("environment")
+
+        # Clients from before the environment was sent launch in the daemon's session
+        if environ is None:
+            return launch_environment(os.environ)
+
+        if not isinstance(environ, dict) or not all(
+                key in LAUNCH_ENVIRONMENT and isinstance(value, str)
+                for key, value in environ.items()):
+            raise ValueError("Malformed environment")
+
+        return environ
+
+    async def _reap(self, sandbox: Sandbox, process: asyncio.subprocess.Process) -> None:
+        returncode = await process.wait()
+        del self._sandboxes[sandbox.pid]
+
+        print(f"'{sandbox.app}' ({sandbox.pid}) exited with {returncode}")
+
+    async def _handle(self, request: Dict) -> Dict:
+        match request.get("action"):
+            case "run":
+                app = request.get("app")
+
+                if not app or "/" in app or app.startswith("."):
+                    return {"error": f"Invalid application '{app}'"}
+
+                if not os.path.exists(self._config_path(app)):
+                    return {"error": f"Application '{app}' is not installed"}
+
+                try:
+                    environ = self._environment(request)
+                except ValueError as e:
+                    return {"error": str(e)}
+
+                try:
+                    sandbox = await self.spawn(app, environ)
+                except (OSError, RuntimeError, KeyError, ValueError) as e:
+                    return {"error": f"Failed to launch '{app}': {e}"}
+
+                return {"pid": sandbox.pid}
+            case "status":
+                return {
+                    "sandboxes": [sandbox.to_dict() for sandbox in self._sandboxes.values()],
+                    "plans": sorted({app for app, _ in self._plans}),
+                }
+            case action:
+                return {"error": f"Unknown action '{action}'"}
+
+    async def _client(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        try:
+            line = await reader.readline()
+
+            try:
+                response = await self._handle(json.loads(line))
+            except (json.JSONDecodeError, AttributeError):
+                response = {"error": "Malformed request"}
+
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+
+        if os.path.lexists(self._path):
+            os.unlink(self._path)
+
+        self.preload()
+
+        server = await asyncio.start_unix_server(self._client, path=self._path)
+        os.chmod(self._path, 0o600)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+
+        watcher = asyncio.create_task(self._watch())
+        print(f"pharaohd listening on {self._path}")
+
+        async with server:
+            await stop.wait()
+
+        watcher.cancel()
+
+        # Running sandboxes are left alone, the next daemon can't reap them but
+        # their dbus leases still keep the proxies alive
+        if os.path.lexists(self._path):
+            os.unlink(self._path)
@@ -0,0 +1,201 @@
+import os, re, tarfile, requests
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Iterator, TYPE_CHECKING
+
+import zstandard as zstd
+
+from src import SYNC_DIRECTORY, PACMAN_LOCAL_DIRECTORY
+
+if TYPE_CHECKING:
+    from src.fetch import Mirror, Package
+    from src.resolve import Dependency
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class DatabaseError(Exception):
+    pass
+
+
+def strip_version(depend: str) -> str:
+    return re.split(r"[<>=]", depend, maxsplit=1)[0].strip()
+
+
+def parse_desc(data: str) -> Dict[str, List[str]]:
+    fields = {}
+    key = None
+
+    for line in data.splitlines():
+        if line.startswith("%") and line.endswith("%"):
+            key = line[1:-1]
+            fields[key] = []
+        elif line and key:
+            fields[key].append(line)
+
+    return fields
+
+
+def write_desc(path: str, fields: Dict[str, List[str]]) -> None:
+    with open(path, "w") as fp:
+        for key, values in fields.items():
+            if values:
+                fp.write(f"%{key}%\n" + "\n".join(values) + "\n\n")
+
+
+@contextmanager
+def open_database(path: str) -> Iterator[tarfile.TarFile]:
+    # tarfile never closes a fileobj it was handed, so everything is closed here
+    with open(path, "rb") as fp:
+        magic = fp.read(4)
+        fp.seek(0)
+
+        if magic == ZSTD_MAGIC:
+            with zstd.ZstdDecompressor().stream_reader(fp, closefd=False) as reader:
+                with tarfile.open(fileobj=reader, mode="r|") as tar:
+                    yield tar
+        else:
+            with tarfile.open(fileobj=fp, mode="r|*") as tar:
+                yield tar
+
+
+def iter_desc_entries(path: str) -> Iterator[Dict[str, List[str]]]:
+    with open_database(path) as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith("/desc"):
+                continue
+
+            yield parse_desc(tar.extractfile(member).read().decode("utf-8"))
+
+
+class SyncDatabase:
+
+    def __init__(self, repos: List[str],
+                 factory: Callable[[Dict[str, List[str]], str], "Package"]) -> None:
+        self._repos = repos
+        self._factory = factory
+        self._packages = {}
+        self._provides = {}
+
+    def __len__(self) -> int:
+        return len(self._packages)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._packages
+
+    @property
+    def packages(self) -> Dict[str, "Package"]:
+        return self._packages
+
+    def sync(self, mirrors: List["Mirror"]) -> None:
+        os.makedirs(SYNC_DIRECTORY, exist_ok=True)
+
+        for repo in self._repos:
+            path = f"{SYNC_DIRECTORY}/{repo}.db"
+
+            for mirror in mirrors:
+                try:
+                    self._download_database(mirror, repo, path)
+                    break
+                except requests.exceptions.RequestException:
+                    continue
+            else:
+                # Resolving against a repo that is silently missing picks the wrong packages
+                raise DatabaseError(f"Failed to sync database '{repo}' from any mirror")
+
+            self.load(repo, path)
+
+    def load(self, repo: str, path: str) -> None:
+        for fields in iter_desc_entries(path):
+            self.add(self._factory(fields, repo))
+
+    def add(self, package: "Package") -> None:
+        # The first repo in REPOS wins, just like pacman
+        if package.name in self._packages:
+            return
+
+        self._packages[package.name] = package
+
+        for provide in package.provides + package.replaces:
+            self._provides.setdefault(strip_version(provide), []).append(package)
+
+    def find(self, name: str) -> Optional["Package"]:
+        name = strip_version(name)
+
+        if name in self._packages:
+            return self._packages[name]
+
+        providers = self._provides.get(name)
+        return providers[0] if providers else None
+
+    def providers(self, name: str) -> List["Package"]:
+        name = strip_version(name)
+        providers = self._provides.get(name, [])
+
+        if name in self._packages:
+            return [self._packages[name]] + providers
+
+        return list(providers)
+
+    def _download_database(self, mirror: "Mirror", repo: str, path: str) -> None:
+        url = f"{mirror.url.replace('$repo', repo)}/{repo}.db"
+
+        r = requests.get(url, stream=True, timeout=30)
+        r.raise_for_status()
+
+        # The previous database stays in place until the new one is complete
+        try:
+            with open(f"{path}.part", "wb") as fp:
+                for chunk in r.iter_content(chunk_size=1 << 20):
+                    fp.write(chunk)
+        except BaseException:
+            os.remove(f"{path}.part")
+            raise
+
+        os.replace(f"{path}.part", path)
+
+
+class LocalDatabase:
+
+    def __init__(self, path: str = PACMAN_LOCAL_DIRECTORY) -> None:
+        self._path = path
+        self._packages = {}
+        self._provides = {}
+
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._packages)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._packages or name in self._provides
+
+    def _load(self) -> None:
+        try:
+            entries = os.scandir(self._path)
+        except FileNotFoundError:
+            return
+
+        with entries:
+            for entry in entries:
+                try:
+                    with open(f"{entry.path}/desc") as fp:
+                        fields = parse_desc(fp.read())
+                except (NotADirectoryError, FileNotFoundError):
+                    continue
+
+                name = fields["NAME"][0]
+                self._packages[name] = fields["VERSION"][0]
+
+                # Sonames like libfoo.so=1-64 are part of the provides too
+                for provide in fields.get("PROVIDES", []):
+                    provide, _, version = provide.partition("=")
+                    self._provides.setdefault(provide, []).append(version or None)
+
+    def satisfies(self, depend: "Dependency") -> bool:
+        version = self._packages.get(depend.name)
+
+        if version and depend.version_matches(version):
+            return True
+
+        return any(depend.version_matches(provided)
+                   for provided in self._provides.get(depend.name, []))
@@ -70,10 +70,14 @@ class DesktopEntry:
             data += "NoDisplay=true"
 
         filename = f"{EXPORT_DIRECTORY}/applications/{entry_name}"
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
 
-        with open(filename, "w") as fp:
+        with open(f"{filename}.tmp", "w") as fp:
             fp.write(data)
 
+        # The export is a link into the app, writing through it would change the app
+        os.replace(f"{filename}.tmp", filename)
+
     @classmethod
     def from_desktop_entry(cls, filename: str) -> Self:
 
@@ -115,10 +119,11 @@ class DesktopEntry:
                    keywords=keywords)
 
 
-def sandboxed_desktop_entry_factory(package: str, entry_name: str,
+def sandboxed_desktop_entry_factory(package: str, app_dir: str, entry_name: str,
                                     script: str) -> DesktopEntry:
+    # Always from the app's own entry, the export is the sandboxed one written last time
     entry = DesktopEntry.from_desktop_entry(
-        filename=f"{EXPORT_DIRECTORY}/applications/{entry_name}")
+        filename=f"{app_dir}/usr/share/applications/{entry_name}")
 
     #entry.add_category("Sandboxed")
     entry.set_exec(script)
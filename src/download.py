@@ -0,0 +1,308 @@
+import os, time, threading, requests, urllib3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+from src import DOWNLOAD_WORKERS, DOWNLOAD_SEGMENTS, EXTRACT_WORKERS
+from src.cache import CacheEntry, PackageCache
+from src.extract import ExtractError, extract_package
+from src.mirrors import MirrorManager
+
+if TYPE_CHECKING:
+    from src.fetch import Mirror, Package
+
+CHUNK_SIZE = 256 * 1024
+
+# (connect, read) timeouts, a stalled mirror is abandoned after the read timeout
+TIMEOUT = (10, 30)
+
+TRANSFER_ERRORS = (requests.exceptions.RequestException,
+                   urllib3.exceptions.HTTPError, OSError)
+
+# Files at least this large are split into byte ranges fetched from several mirrors
+SEGMENT_THRESHOLD = 32 * 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class MirrorStream:
+
+    def __init__(self, downloader: "Downloader", package: "Package",
+                 offset: int = 0, end: Optional[int] = None,
+                 first: Optional["Mirror"] = None) -> None:
+        self._downloader = downloader
+        self._package = package
+        self._end = end
+
+        mirrors = downloader.mirrors.ranked()
+        if first:
+            mirrors = [first] + [mirror for mirror in mirrors if mirror is not first]
+        self._candidates = iter(mirrors)
+
+        self._offset = offset
+        self._response = None
+        self._mirror = None
+        self._received = 0
+        self._started = 0
+
+        if end is None or offset < end:
+            self._open()
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    def _open(self) -> None:
+        manager = self._downloader.mirrors
+
+        for mirror in self._candidates:
+            headers = {}
+
+            if self._offset or self._end:
+                end = self._end - 1 if self._end else ""
+                headers["Range"] = f"bytes={self._offset}-{end}"
+            url = self._downloader.url(mirror, self._package)
+
+            try:
+                r = self._downloader.session(mirror).get(url, stream=True,
+                                                         timeout=TIMEOUT,
+                                                         headers=headers)
+                r.raise_for_status()
+                r.raw.decode_content = True
+
+                # Mirrors without range support start over, skip what we already have
+                if self._offset and r.status_code != 206:
+                    skip = self._offset
+                    while skip:
+                        data = r.raw.read(min(skip, CHUNK_SIZE))
+                        if not data:
+                            raise DownloadError("short response")
+                        skip -= len(data)
+            except (DownloadError, *TRANSFER_ERRORS):
+                manager.record_failure(mirror)
+                continue
+
+            self._response = r
+            self._mirror = mirror
+            self._received = 0
+            self._started = time.monotonic()
+            return
+
+        raise DownloadError(f"All mirrors failed for {self._package.filename}")
+
+    def _close(self) -> None:
+        if self._response:
+            self._response.close()
+            self._response = None
+
+    def read(self, size: int = -1) -> bytes:
+        if self._end is not None:
+            remaining = self._end - self._offset
+            size = remaining if size < 0 else min(size, remaining)
+
+        while self._response:
+            try:
+                data = self._response.raw.read(size) if size else b""
+            except TRANSFER_ERRORS:
+                # Fail over in the middle of the file, the next mirror picks up at the offset
+                self._downloader.mirrors.record_failure(self._mirror)
+                self._close()
+                self._open()
+                continue
+
+            if not data:
+                elapsed = time.monotonic() - self._started
+                self._downloader.mirrors.record_success(self._mirror,
+                                                        self._received, elapsed)
+                self._close()
+                return data
+
+            self._offset += len(data)
+            self._received += len(data)
+            return data
+
+        return b""
+
+    def close(self) -> None:
+        self._close()
+
+
+class Downloader:
+
+    def __init__(self, mirrors: MirrorManager, cache: PackageCache,
+                 workers: int = DOWNLOAD_WORKERS) -> None:
+        self._mirrors = mirrors
+        self._workers = max(1, workers)
+        self._cache = cache
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @property
+    def mirrors(self) -> MirrorManager:
+        return self._mirrors
+
+    def close(self) -> None:
+        for session in self._sessions.values():
+            session.close()
+
+        self._sessions.clear()
+
+    def session(self, mirror: "Mirror") -> requests.Session:
+        # One keep-alive pool per mirror, sized so every worker can hold a connection
+        with self._lock:
+            session = self._sessions.get(mirror.url)
+
+            if not session:
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self._workers)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[mirror.url] = session
+
+            return session
+
+    def extract(self, packages: List["Package"],
+                destination: str) -> Dict[str, List[str]]:
+        os.makedirs(destination, exist_ok=True)
+
+        files = {}
+        total = sum(package.csize for package in packages)
+
+        # Every package is parsed on its own thread, the file writes of all of them
+        # share one pool
+        with tqdm(total=total, unit='B', unit_scale=True,
+                  desc=f"Installing {len(packages)} packages") as pbar:
+            with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as writers, \
+                 ThreadPoolExecutor(max_workers=self._workers) as pool:
+                futures = {
+                    pool.submit(self._fetch_and_extract, package, destination,
+                                pbar, writers): package
+                    for package in packages
+                }
+
+                for future in as_completed(futures):
+                    files[futures[future].name] = future.result()
+
+        return files
+
+    def prefetch(self, packages: List["Package"]) -> None:
+        total = sum(package.csize for package in packages)
+
+        # Only fills the cache, the apps extract from it afterwards
+        with tqdm(total=total, unit='B', unit_scale=True,
+                  desc=f"Downloading {len(packages)} packages") as pbar:
+            with ThreadPoolExecutor(max_workers=self._workers) as pool:
+                futures = [pool.submit(self._fetch, package, pbar) for package in packages]
+
+                for future in as_completed(futures):
+                    future.result()
+
+    def _fetch(self, package: "Package", pbar: tqdm) -> str:
+        if not package.sha256sum:
+            raise DownloadError(f"{package.filename} has no checksum in the sync database, "
+                                "refusing to install it")
+
+        cached = self._cache.get(package)
+
+        if cached:
+            pbar.update(package.csize)
+            return cached
+
+        entry = self._cache.open(package)
+
+        try:
+            if self._is_segmented(package, entry):
+                self._fetch_segmented(package, entry, pbar)
+            else:
+                if entry.segments is not None:
+                    entry.reset()
+
+                pbar.update(entry.offset)
+                stream = MirrorStream(self, package, offset=entry.offset,
+                                      end=package.csize or None)
+
+                try:
+                    while data := stream.read(CHUNK_SIZE):
+                        entry.write(data)
+                        pbar.update(len(data))
+                finally:
+                    stream.close()
+        except BaseException:
+            entry.abort()
+            raise
+
+        return entry.commit()
+
+    def url(self, mirror: "Mirror", package: "Package") -> str:
+        return f"{mirror.url.replace('$repo', package.repo)}/{package.filename}"
+
+    def _split(self, size: int) -> List[List[int]]:
+        count = min(DOWNLOAD_SEGMENTS, len(self._mirrors))
+        step = -(-size // count)
+
+        # [start, position, end) for every segment
+        return [[start, start, min(start + step, size)] for start in range(0, size, step)]
+
+    def _fetch_segment(self, package: "Package", entry: CacheEntry,
+                       segment: List[int], mirror: "Mirror", pbar: tqdm) -> None:
+        stream = MirrorStream(self, package, offset=segment[1], end=segment[2],
+                              first=mirror)
+
+        try:
+            while data := stream.read(CHUNK_SIZE):
+                entry.write_at(segment[1], data)
+                segment[1] += len(data)
+                pbar.update(len(data))
+        finally:
+            stream.close()
+
+    def _fetch_segmented(self, package: "Package", entry: CacheEntry,
+                         pbar: tqdm) -> None:
+        segments = entry.segments
+
+        if segments is None:
+            entry.reset()
+            segments = self._split(package.csize)
+            entry.save_segments(segments)
+
+        entry.allocate(package.csize)
+        pbar.update(sum(position - start for start, position, end in segments))
+
+        # Every segment starts on a different mirror out of the best ranked ones
+        mirrors = self._mirrors.ranked()
+        pending = [segment for segment in segments if segment[1] < segment[2]]
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+                futures = [
+                    pool.submit(self._fetch_segment, package, entry, segment,
+                                mirrors[index % len(mirrors)], pbar)
+                    for index, segment in enumerate(pending)
+                ]
+
+                for future in futures:
+                    future.result()
+        finally:
+            entry.save_segments(segments)
+
+    def _is_segmented(self, package: "Package", entry: Optional[CacheEntry]) -> bool:
+        return (entry is not None and entry.resumable and DOWNLOAD_SEGMENTS > 1
+                and len(self._mirrors) > 1 and package.csize >= SEGMENT_THRESHOLD)
+
+    def _fetch_and_extract(self, package: "Package", destination: str,
+                           pbar: tqdm, writers: ThreadPoolExecutor) -> List[str]:
+        # Extraction writes into the live app, so only a file whose checksum already
+        # passed is extracted. Other packages keep downloading meanwhile
+        path = self._fetch(package, pbar)
+
+        with open(path, "rb") as f:
+            try:
+                return extract_package(f, destination, writers, package.name)
+            except ExtractError as e:
+                raise DownloadError(f"Refusing to extract {package.filename}: {e}")
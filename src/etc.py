@@ -0,0 +1,125 @@
+import os
+from typing import List
+
+# Host files that change underneath us (network, users, locale) and stay live binds
+ETC_HOST_FILES = [
+    "/etc/ssl/certs/ca-bundle.crt", "/etc/ssl/certs/ca-certificates.crt",
+    "/etc/resolv.conf", "/etc/hosts", "/etc/ld.so.preload", "/etc/ld.so.conf",
+    "/etc/ld.so.cache", "/etc/passwd", "/etc/locale.conf"
+]
+
+# Host directories that only change with host package updates, copied at install
+ETC_HOST_DIRECTORIES = ["/etc/ld.so.conf.d", "/etc/fonts"]
+
+# Only bound when a permission asks for them, but still need a mount point
+ETC_MOUNT_POINTS = ["/etc/machine-id"]
+
+
+def staged_etc_path(path: str) -> str:
+    return f"{path}/.pharaoh/etc"
+
+
+def ld_cache_path(path: str) -> str:
+    return f"{path}/.pharaoh/ld.so.cache"
+
+
+def etc_host_binds(path: str) -> List[str]:
+    staged = staged_etc_path(path)
+    binds = []
+
+    for file in ETC_HOST_FILES:
+        relative = os.path.relpath(file, "/etc")
+
+        # Only files that had a mount point staged, and the app does not ship itself
+        if (os.path.lexists(f"{staged}/{relative}")
+                and not os.path.lexists(f"{path}/etc/{relative}")):
+            binds.append(file)
+
+    return binds
+
+
+def _copy(source: str, target: str) -> None:
+    if os.path.islink(source):
+        os.symlink(os.readlink(source), target)
+        return
+
+    try:
+        os.link(source, target)
+    except OSError:
+        # Different filesystem or foreign owner, fall back to a private copy
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            while data := src.read(1024 * 1024):
+                dst.write(data)
+
+        os.chmod(target, os.stat(source).st_mode & 0o7777)
+
+
+def _merge(source: str, target: str) -> None:
+    for root, dirs, files in os.walk(source):
+        relative = os.path.relpath(root, source)
+        destination = os.path.normpath(f"{target}/{relative}")
+
+        os.makedirs(destination, exist_ok=True)
+
+        # os.walk lists symlinks to directories as directories
+        for name in dirs + files:
+            path = f"{root}/{name}"
+
+            if name in dirs and not os.path.islink(path):
+                continue
+
+            if os.path.lexists(f"{destination}/{name}"):
+                os.unlink(f"{destination}/{name}")
+
+            _copy(path, f"{destination}/{name}")
+
+
+def _remove(path: str) -> None:
+    if not os.path.lexists(path):
+        return
+
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            os.unlink(f"{root}/{name}")
+
+        for name in dirs:
+            if os.path.islink(f"{root}/{name}"):
+                os.unlink(f"{root}/{name}")
+            else:
+                os.rmdir(f"{root}/{name}")
+
+    os.rmdir(path)
+
+
+def stage_etc(path: str) -> None:
+    staged = staged_etc_path(path)
+    temporary = f"{staged}.tmp"
+
+    _remove(temporary)
+    os.makedirs(temporary)
+
+    for directory in ETC_HOST_DIRECTORIES:
+        if os.path.isdir(directory):
+            _merge(directory, f"{temporary}/{os.path.relpath(directory, '/etc')}")
+
+    # The app's own files win over the host copies
+    if os.path.isdir(f"{path}/etc"):
+        _merge(f"{path}/etc", temporary)
+
+    # /etc is mounted read-only, so the live binds need their mount points up front
+    for file in ETC_HOST_FILES + ETC_MOUNT_POINTS:
+        target = f"{temporary}/{os.path.relpath(file, '/etc')}"
+
+        if os.path.lexists(target) or not os.path.exists(file):
+            continue
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        open(target, "w").close()
+
+    _remove(f"{staged}.old")
+
+    if os.path.lexists(staged):
+        os.rename(staged, f"{staged}.old")
+
+    os.rename(temporary, staged)
+    _remove(f"{staged}.old")
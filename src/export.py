@@ -0,0 +1,155 @@
+import os
+from typing import Dict, Iterable, Set, Tuple
+
+from src import EXPORT_DIRECTORY
+
+# What the host desktop needs from usr/share, everything else stays in the app
+EXPORT_PATHS = ("applications", "icons", "metainfo", "mime", "dbus-1/services")
+
+
+class Exporter:
+
+    def __init__(self, path: str = EXPORT_DIRECTORY) -> None:
+        self._path = path.rstrip("/")
+        self._refs = f"{self._path}/.pharaoh"
+
+        os.makedirs(self._refs, exist_ok=True)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _sources(self, app_dir: str) -> Dict[str, str]:
+        sources = {}
+
+        for export in EXPORT_PATHS:
+            base = f"{app_dir}/usr/share/{export}"
+
+            for root, dirs, files in os.walk(base):
+                relative = os.path.relpath(root, f"{app_dir}/usr/share")
+
+                # Symlinked directories are not walked into, they are exported as they are
+                names = files + [name for name in dirs if os.path.islink(f"{root}/{name}")]
+
+                for name in names:
+                    sources[f"{relative}/{name}"] = f"{root}/{name}"
+
+        return sources
+
+    def _claimed(self, app: str) -> Set[str]:
+        claimed = set()
+
+        for other in os.listdir(self._refs):
+            if other != app and not other.endswith(".tmp"):
+                claimed |= self._read_refs(other)
+
+        return claimed
+
+    def _owned(self, target: str, owned: Set[str], claimed: Set[str], relative: str) -> bool:
+        if relative in owned or not os.path.lexists(target):
+            return True
+
+        # Left over from the exports that used to be copied, no app lists it
+        if relative not in claimed:
+            return True
+
+        # Another app got there first, unless that app is gone
+        return os.path.islink(target) and not os.path.exists(target)
+
+    def _link(self, source: str, target: str) -> None:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        temporary = f"{target}.pharaoh-export"
+
+        if os.path.lexists(temporary):
+            os.unlink(temporary)
+
+        os.symlink(source, temporary)
+        os.replace(temporary, target)
+
+    def _unlink(self, target: str) -> None:
+        try:
+            os.unlink(target)
+        except FileNotFoundError:
+            return
+
+        # Leave no empty icon theme directories behind
+        parent = os.path.dirname(target)
+
+        while parent != self._path:
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+
+            parent = os.path.dirname(parent)
+
+    def export(self, app: str, app_dir: str, generated: Iterable[str] = ()) -> Tuple[int, int]:
+        app_dir = app_dir.rstrip("/")
+        owned = self._read_refs(app)
+        claimed = self._claimed(app)
+        sources = self._sources(app_dir)
+        added = removed = 0
+
+        # Written by pharaoh itself, like the sandboxed desktop entry. They belong to
+        # the app but are never swapped for a link to the unsandboxed original
+        generated = {relative for relative in generated
+                     if self._owned(f"{self._path}/{relative}", owned, claimed, relative)}
+        exported = set(generated)
+
+        for relative, source in sources.items():
+            if relative in generated:
+                continue
+
+            target = f"{self._path}/{relative}"
+
+            if not self._owned(target, owned, claimed, relative):
+                continue
+
+            exported.add(relative)
+
+            # Unchanged exports are left alone, only new and moved files are relinked
+            if os.path.islink(target) and os.readlink(target) == source:
+                continue
+
+            self._link(source, target)
+            added += 1
+
+        for relative in owned - exported:
+            self._unlink(f"{self._path}/{relative}")
+            removed += 1
+
+        self._write_refs(app, exported)
+        return added, removed
+
+    def exports(self, app: str) -> Set[str]:
+        return self._read_refs(app)
+
+    def remove(self, app: str) -> int:
+        removed = 0
+
+        for relative in self._read_refs(app):
+            self._unlink(f"{self._path}/{relative}")
+            removed += 1
+
+        try:
+            os.remove(f"{self._refs}/{app}")
+        except FileNotFoundError:
+            pass
+
+        return removed
+
+    def _read_refs(self, app: str) -> Set[str]:
+        try:
+            with open(f"{self._refs}/{app}") as fp:
+                return set(line.strip() for line in fp if line.strip())
+        except FileNotFoundError:
+            return set()
+
+    def _write_refs(self, app: str, refs: Set[str]) -> None:
+        path = f"{self._refs}/{app}"
+
+        with open(f"{path}.tmp", "w") as fp:
+            fp.write("\n".join(sorted(refs)))
+
+        os.replace(f"{path}.tmp", path)
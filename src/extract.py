@@ -0,0 +1,335 @@
+import os, grp, pwd, shutil, tarfile, functools, threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait as futures_wait
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+import zstandard as zstd
+
+from src import EXTRACT_WORKERS
+from src.mtree import METADATA_FILES, MtreeEntry, load_mtree, parse_mtree, save_mtree
+
+READ_SIZE = 1024 * 1024
+
+# Files up to this size are read into memory and written by the pool
+SMALL_FILE_SIZE = 256 * 1024
+
+# Small files are handed to the pool in batches of this many files or bytes
+BATCH_FILES = 32
+BATCH_SIZE = 1024 * 1024
+PENDING_BATCHES = 64
+
+
+class ExtractError(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def owner(uname: str, uid: int, gname: str, gid: int) -> Tuple[int, int]:
+    # Same lookup as TarFile.chown, done once per owner instead of once per file
+    try:
+        gid = grp.getgrnam(gname)[2] if gname else gid
+    except KeyError:
+        pass
+
+    try:
+        uid = pwd.getpwnam(uname)[2] if uname else uid
+    except KeyError:
+        pass
+
+    return uid, gid
+
+
+class ParallelExtractor:
+
+    def __init__(self, tar: tarfile.TarFile, destination: str,
+                 pool: ThreadPoolExecutor) -> None:
+        self._destination = destination
+        self._real_destination = os.path.realpath(destination)
+        self._pool = pool
+
+        self._filter = tar.extraction_filter
+        self._tar = tar
+        self._root = os.geteuid() == 0
+
+        # Bounds the payloads held in memory while the writers catch up
+        self._slots = threading.Semaphore(PENDING_BATCHES)
+        self._batch: List[Tuple[tarfile.TarInfo, str, bytes]] = []
+        self._batch_size = 0
+
+        # None while the write is still in the batch that hasn't been submitted
+        self._pending: Dict[str, Optional[Future]] = {}
+        self._directories: List[tarfile.TarInfo] = []
+        self._created = set()
+
+        # Directories known to resolve inside the destination, and their ancestors
+        self._contained = set()
+        self._ancestors = set()
+
+        # Entries the previous version of the package already put there
+        self._unchanged: Dict[str, MtreeEntry] = {}
+
+    def delta(self, previous: Dict[str, MtreeEntry], current: Dict[str, MtreeEntry]) -> None:
+        self._unchanged = {path: entry for path, entry in current.items()
+                           if previous.get(path) == entry}
+
+    def _identical(self, member: tarfile.TarInfo, target: str) -> bool:
+        entry = self._unchanged.get(member.name)
+
+        if entry is None:
+            return False
+
+        try:
+            st = os.lstat(target)
+        except FileNotFoundError:
+            return False
+
+        # Only what lstat can see, pharaoh verify is the one that reads the files
+        if not entry.matches(st):
+            return False
+
+        if self._root and (st.st_uid, st.st_gid) != owner(member.uname, member.uid,
+                                                          member.gname, member.gid):
+            return False
+
+        if member.issym():
+            return os.readlink(target) == member.linkname
+
+        return member.isreg() or member.islnk()
+
+    def _check(self, name: str) -> None:
+        # Absolute symlink targets and setuid files are fine, landing outside the app is not
+        if os.path.isabs(name) or ".." in name.split("/"):
+            raise ExtractError(f"'{name}' is outside of the destination")
+
+    def _resolve(self, directory: str) -> None:
+        if not directory or directory in self._contained:
+            return
+
+        real = os.path.realpath(f"{self._destination}/{directory}")
+
+        if os.path.commonpath([real, self._real_destination]) != self._real_destination:
+            raise ExtractError(f"'{directory}' resolves outside of the destination")
+
+        self._contained.add(directory)
+
+        while directory := os.path.dirname(directory):
+            self._ancestors.add(directory)
+
+    def _forget(self, member: tarfile.TarInfo) -> None:
+        # A symlink replacing a directory that was already resolved may point anywhere
+        if member.name in self._contained or member.name in self._ancestors:
+            self._contained.clear()
+            self._ancestors.clear()
+
+    def _wait(self, name: str) -> None:
+        # Anything touching a path has to come after the write that is still queued for it
+        if name not in self._pending:
+            return
+
+        if self._pending[name] is None:
+            self._flush()
+
+        self._pending.pop(name).result()
+
+    def _parent(self, member: tarfile.TarInfo) -> None:
+        parent = os.path.dirname(member.name)
+
+        # Several packages may be extracting into the same tree at once
+        if parent and parent not in self._created:
+            os.makedirs(f"{self._destination}/{parent}", exist_ok=True)
+            self._created.add(parent)
+
+    def _replace(self, create: Callable[[], int], target: str) -> int:
+        try:
+            return create()
+        except FileExistsError:
+            # Never write through a file that is hardlinked into the store
+            os.unlink(target)
+            return create()
+
+    def _attributes(self, member: tarfile.TarInfo, target: str) -> None:
+        if self._root:
+            os.chown(target, *owner(member.uname, member.uid, member.gname, member.gid),
+                     follow_symlinks=False)
+
+        if not member.issym():
+            os.chmod(target, member.mode)
+            os.utime(target, (member.mtime, member.mtime))
+
+    def _write(self, batch: List[Tuple[tarfile.TarInfo, str, bytes]]) -> None:
+        try:
+            for member, target, data in batch:
+                flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC
+                fd = self._replace(lambda: os.open(target, flags, 0o600), target)
+
+                try:
+                    view = memoryview(data)
+                    while view:
+                        view = view[os.write(fd, view):]
+
+                    if self._root:
+                        os.fchown(fd, *owner(member.uname, member.uid, member.gname, member.gid))
+
+                    os.fchmod(fd, member.mode)
+                    os.utime(fd, (member.mtime, member.mtime))
+                finally:
+                    os.close(fd)
+        finally:
+            self._slots.release()
+
+    def _flush(self) -> None:
+        if not self._batch:
+            return
+
+        batch, self._batch, self._batch_size = self._batch, [], 0
+
+        self._slots.acquire()
+
+        try:
+            future = self._pool.submit(self._write, batch)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        for member, target, data in batch:
+            self._pending[member.name] = future
+
+    def _file(self, member: tarfile.TarInfo, target: str) -> None:
+        source = self._tar.extractfile(member)
+
+        if member.size > SMALL_FILE_SIZE:
+            # Big files are streamed here instead of being held in memory
+            self._replace(lambda: os.close(os.open(target, os.O_CREAT | os.O_EXCL, 0o600)), target)
+
+            with open(target, "wb") as fp:
+                shutil.copyfileobj(source, fp, READ_SIZE)
+
+            self._attributes(member, target)
+            return
+
+        # One task per file would cost more in the executor than the write itself
+        self._batch.append((member, target, source.read()))
+        self._batch_size += member.size
+        self._pending[member.name] = None
+
+        if len(self._batch) >= BATCH_FILES or self._batch_size >= BATCH_SIZE:
+            self._flush()
+
+    def extract(self, member: tarfile.TarInfo) -> None:
+        if self._filter:
+            member = self._filter(member, self._destination)
+
+        self._check(member.name)
+        self._resolve(os.path.dirname(member.name))
+
+        if member.islnk():
+            self._check(member.linkname)
+            self._resolve(os.path.dirname(member.linkname))
+
+        self._wait(member.name)
+
+        if member.isdir():
+            # makedirs and the attributes set at the end follow an existing symlink
+            self._resolve(member.name)
+            os.makedirs(f"{self._destination}/{member.name}", exist_ok=True)
+            self._created.add(member.name)
+            self._directories.append(member)
+            return
+
+        target = f"{self._destination}/{member.name}"
+
+        # Left as it is, the tar stream skips over the payload without it being written
+        if self._identical(member, target):
+            return
+
+        self._parent(member)
+
+        if member.isreg():
+            self._file(member, target)
+        elif member.issym():
+            self._forget(member)
+            self._replace(lambda: os.symlink(member.linkname, target), target)
+            self._attributes(member, target)
+        elif member.islnk():
+            self._wait(member.linkname)
+            self._replace(lambda: os.link(f"{self._destination}/{member.linkname}", target,
+                                          follow_symlinks=False), target)
+            self._attributes(member, target)
+        else:
+            if os.path.lexists(target):
+                os.unlink(target)
+
+            self._tar.extract(member, path=self._destination)
+
+    def finish(self) -> None:
+        self._flush()
+
+        futures = set(self._pending.values())
+        self._pending.clear()
+
+        futures_wait(futures)
+
+        for future in futures:
+            future.result()
+
+        # Children before their parents like extractall, a read-only directory is set up last
+        for member in sorted(self._directories, key=lambda member: member.name, reverse=True):
+            self._attributes(member, f"{self._destination}/{member.name}")
+
+    def abort(self) -> None:
+        self._batch.clear()
+
+        futures = {future for future in self._pending.values() if future}
+        self._pending.clear()
+
+        for future in futures:
+            future.cancel()
+
+        futures_wait(futures)
+
+
+def extract_package(fileobj: BinaryIO, destination: str,
+                    pool: Optional[ThreadPoolExecutor] = None,
+                    name: Optional[str] = None) -> List[str]:
+    if pool is None:
+        with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as pool:
+            return extract_package(fileobj, destination, pool, name)
+
+    files = []
+    mtree = None
+
+    # What the installed version of the package looked like, if it was installed with one
+    previous = load_mtree(destination, name) if name else None
+    decompressor = zstd.ZstdDecompressor()
+
+    # This thread decompresses and parses, the pool does the small file writes
+    with decompressor.stream_reader(fileobj, read_size=READ_SIZE, closefd=False) as reader:
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            # Checksummed packages are trusted like extractall always did, they ship
+            # absolute symlinks into /usr and /etc and setuid helpers
+            tar.extraction_filter = getattr(tarfile, "fully_trusted_filter", None)
+            extractor = ParallelExtractor(tar, destination, pool)
+
+            try:
+                for member in tar:
+                    # makepkg puts .MTREE ahead of the payload, so it is known before any file
+                    if member.name == ".MTREE" and member.isreg():
+                        mtree = tar.extractfile(member).read()
+
+                        if previous:
+                            extractor.delta(previous, parse_mtree(mtree))
+
+                    if member.name in METADATA_FILES:
+                        continue
+
+                    extractor.extract(member)
+                    files.append(member.name)
+            except BaseException:
+                extractor.abort()
+                raise
+
+            extractor.finish()
+
+    if name and mtree:
+        save_mtree(destination, name, mtree)
+
+    return files
@@ -1,11 +1,24 @@
-import requests, random, tarfile, os, pathlib, shutil, subprocess
+import os, shutil
+from sqlite3 import Row
 from typing import List
 from pathlib import Path
-import zstandard as zstd
-from typing import Dict, Self, Set
-from tqdm import tqdm
-
-from src import ARCH, REPOS, EXPORT_DIRECTORY, APPLICATION_DIRECTORY
+from typing import Dict, Optional, Self, Tuple
+
+from src import ARCH, REPOS, APPLICATION_DIRECTORY, DOWNLOAD_WORKERS, MIRRORLIST
+from src.database import SyncDatabase, LocalDatabase
+from src.resolve import Dependency, Plan, Resolver, ResolveError
+from src.cache import PackageCache, ChecksumError
+from src.download import Downloader, DownloadError
+from src.mirrors import MirrorManager
+from src.store import ObjectStore
+from src.export import Exporter
+from src.mtree import mtree_path
+from src.state import StateDatabase
+from src.runtime import Runtime
+from src.plan import bump_generation
+from src.etc import stage_etc
+from src.ldcache import generate_ld_cache
+from src.seccomp import SeccompCache, SeccompPolicy
 from src.config import ConfigBuilder
 from src.permissions import Permissions, PermissionList, DBusPermissionList, DBusPermissions
 from src.desktop import DesktopEntry, sandboxed_desktop_entry_factory
@@ -36,25 +49,42 @@ class Mirror:
 
 class Package:
 
+    __slots__ = ("_name", "_version", "_filename", "_repo", "_arch",
+                 "_depends", "_makedepends", "_optdepends", "_provides",
+                 "_replaces", "_conflicts", "_sha256sum", "_csize", "_entry")
+
     def __init__(self, name: str, filename: str, repo: str, arch: str,
-                 depends: List[str], makedepends: List[str], optdepends: List[str]) -> None:
+                 depends: List[str], makedepends: List[str], optdepends: List[str],
+                 version: str = None, provides: List[str] = None,
+                 replaces: List[str] = None, conflicts: List[str] = None,
+                 sha256sum: str = None, csize: int = 0) -> None:
         self._name = name
+        self._version = version
         self._filename = filename
         self._repo = repo
         self._arch = arch
         self._depends = depends
         self._optdepends = optdepends
         self._makedepends = makedepends
+        self._provides = provides or []
+        self._replaces = replaces or []
+        self._conflicts = conflicts or []
+        self._sha256sum = sha256sum
+        self._csize = csize
 
         self._entry = None
 
     def __repr__(self) -> str:
-        return f"Package(name={repr(self._name)}, filename={repr(self._filename)}, repo={repr(self._repo)}, arch={repr(self._arch)})"
+        return f"Package(name={repr(self._name)}, version={repr(self._version)}, filename={repr(self._filename)}, repo={repr(self._repo)}, arch={repr(self._arch)})"
 
     @property
     def name(self) -> str:
         return self._name
 
+    @property
+    def version(self) -> str:
+        return self._version
+
     @property
     def entry(self) -> str:
         return self._entry
@@ -71,6 +101,26 @@ class Package:
     def optdepends(self) -> List[str]:
         return self._optdepends
 
+    @property
+    def provides(self) -> List[str]:
+        return self._provides
+
+    @property
+    def replaces(self) -> List[str]:
+        return self._replaces
+
+    @property
+    def conflicts(self) -> List[str]:
+        return self._conflicts
+
+    @property
+    def sha256sum(self) -> str:
+        return self._sha256sum
+
+    @property
+    def csize(self) -> int:
+        return self._csize
+
     @property
     def filename(self) -> str:
         return self._filename
@@ -79,86 +129,381 @@ class Package:
     def repo(self) -> str:
         return self._repo
 
+    def to_desc(self) -> Dict[str, List[str]]:
+        return {
+            "FILENAME": [self._filename],
+            "NAME": [self._name],
+            "VERSION": [self._version],
+            "ARCH": [self._arch],
+            "CSIZE": [str(self._csize)],
+            "SHA256SUM": [self._sha256sum] if self._sha256sum else [],
+            "DEPENDS": self._depends,
+            "PROVIDES": self._provides,
+            "CONFLICTS": self._conflicts,
+            "REPLACES": self._replaces,
+        }
+
     @classmethod
-    def from_dict(cls, data) -> Dict[str, str]:
+    def from_desc(cls, data: Dict[str, List[str]], repo: str) -> Self:
+        def field(key: str) -> str:
+            return data[key][0] if data.get(key) else None
+
         return cls(
-            name=data['pkgname'],
-            filename=data['filename'],
-            repo=data['repo'],
-            arch=data['arch'],
-            depends=[x.split("=")[0] if "=" in x else x for x in data.get('depends')],
-            makedepends=None,
-            optdepends=[x.split(":")[0] for x in data.get('optdepends')])
+            name=field('NAME'),
+            version=field('VERSION'),
+            filename=field('FILENAME'),
+            repo=repo,
+            arch=field('ARCH'),
+            depends=data.get('DEPENDS', []),
+            makedepends=data.get('MAKEDEPENDS', []),
+            optdepends=[x.split(":")[0] for x in data.get('OPTDEPENDS', [])],
+            provides=data.get('PROVIDES'),
+            replaces=data.get('REPLACES'),
+            conflicts=data.get('CONFLICTS'),
+            sha256sum=field('SHA256SUM'),
+            csize=int(field('CSIZE') or 0))
 
 
 class PackageManager:
 
-    def __init__(self) -> None:
-        self._mirrors = self._fetch_mirrors()
+    def __init__(self, workers: int = DOWNLOAD_WORKERS) -> None:
+        self._mirrors = MirrorManager(self._fetch_mirrors())
+        self._mirrors.probe()
+
+        self._database = SyncDatabase(REPOS, factory=Package.from_desc)
+        self._database.sync(self._mirrors.ranked())
+        self._cache = PackageCache()
+        self._store = ObjectStore()
+        self._exporter = Exporter()
+        self._state = StateDatabase()
+        self._downloader = Downloader(self._mirrors, workers=workers, cache=self._cache)
+        self._local_database = LocalDatabase()
+        self._resolver = Resolver(self._database, is_installed=self._is_installed)
+        self._runtimes = []
+
+    def close(self) -> None:
+        self._downloader.close()
+        self._state.close()
+
+    def resolve(self, package_name: str) -> Optional[Plan]:
+        package = self._find_package(package_name)
 
-    def install(self, package_name: str) -> None:
+        if not package:
+            print(f"Failed to find package: '{package_name}'")
+            return None
+
+        return self._resolver.resolve(package)
+
+    def install(self, package_name: str, dry_run: bool = False,
+                runtimes: Optional[List[str]] = None) -> None:
         app_dir = f"{APPLICATION_DIRECTORY}{package_name}"
-        package = self._find_package(package_name)
 
-        self._download_package(package)
-        self._package_package(package, app_dir)
-        self._install_dependencies(package, app_dir)
-        self._install_package(package, app_dir)
+        self._runtimes = [Runtime(name) for name in runtimes or []]
 
-    def _install_optional_dependencies(self, package: Package,
-                                       app_dir: str) -> None:
-        want = ["wayland", "gtk"]
+        for runtime in self._runtimes:
+            if not runtime.exists():
+                print(f"Runtime '{runtime.name}' is not installed")
+                return
 
-        for depend in package.optdepends:
-            for key in want:
-                if key in depend:
-                    package = self._find_package(depend)
-                    self._download_package(package)
-                    self._package_package(package, app_dir)
-                    #self._install_package(package, app_dir)
+        try:
+            plan = self.resolve(package_name)
+        except ResolveError as e:
+            print(f"Failed to resolve '{package_name}': {e}")
+            return
 
-    def _install_dependencies(
-            self,
-            package: Package,
-            app_dir: str,
-            installed_dependencies: Set[str] = None) -> List[str]:
+        if not plan:
+            return
 
-        if not installed_dependencies:
-            installed_dependencies = set()
+        plan.print()
 
-        for depend in package.depends:
+        if dry_run:
+            return
 
-            if self._is_installed(depend) or depend in installed_dependencies:
-                continue
+        fresh = not os.path.exists(app_dir)
+        os.makedirs(app_dir, exist_ok=True)
+
+        try:
+            files = self._download_packages(plan.packages, app_dir)
+        except ChecksumError as e:
+            print(f"Checksum mismatch for {e}")
+            return
+        except DownloadError as e:
+            print(e)
+            return
+        finally:
+            self._mirrors.save()
+
+        # Only known once the files are in, the sync database has no file lists
+        plan.target._entry = self._find_entry(files[plan.target.name])
+
+        if not plan.target.entry:
+            print(f"'{package_name}' has no desktop entry, only applications can be installed")
+
+            if fresh:
+                shutil.rmtree(app_dir)
+            return
+
+        # One merged /etc per app keeps the bind count independent of the package
+        stage_etc(app_dir)
+        generate_ld_cache(app_dir, [runtime.path for runtime in self._runtimes])
+        bump_generation(app_dir)
+
+        self._export_package(package_name, app_dir, plan.target.entry)
+
+        linked, saved = self._store.deduplicate(package_name, app_dir)
+        print(f"Deduplicated {linked} files, saved {saved / (1024 * 1024):.2f} MiB")
+
+        self._install_package(plan.target, app_dir)
+
+        self._state.record(app=package_name, path=app_dir, target=plan.target,
+                           packages=plan.packages, files=files,
+                           exports=self._exporter.exports(package_name),
+                           runtimes=[runtime.name for runtime in self._runtimes])
+
+        self._cache.evict()
+
+    def update(self, apps: Optional[List[str]] = None, dry_run: bool = False) -> None:
+        if apps is None:
+            apps = [row["name"] for row in self._state.apps()]
+
+        updates = [update for update in map(self._plan_update, apps) if update]
+
+        if not updates:
+            print("Everything is up to date")
+            return
+
+        # Every changed package is fetched once, however many apps share it
+        changed = {}
+        for app, record, plan, packages, removed in updates:
+            for package in packages:
+                changed.setdefault((package.name, package.version, package.sha256sum), package)
+
+        size = sum(package.csize for package in changed.values())
+        print(f"Total download size: {size / (1024 * 1024):.2f} MiB")
+
+        if dry_run:
+            return
+
+        try:
+            # Packages without a checksum can't be cached, every app streams its own copy
+            self._downloader.prefetch([package for package in changed.values()
+                                       if package.sha256sum])
+        except ChecksumError as e:
+            print(f"Checksum mismatch for {e}")
+            return
+        except DownloadError as e:
+            print(e)
+            return
+        finally:
+            self._mirrors.save()
+
+        for update in updates:
+            self._apply_update(*update)
+
+        freed = self._store.collect()
+        print(f"Freed {freed / (1024 * 1024):.2f} MiB of shared files")
 
-            package = self._find_package(depend)
+        self._cache.evict()
 
-            if package:
-                print(f"Installing dependency {package.name}")
+    def _plan_update(self, app: str) -> Optional[Tuple]:
+        record = self._state.app(app)
 
-                self._download_package(package)
-                self._package_package(package, app_dir)
-                #self._install_package(package, app_dir)
+        if not record:
+            print(f"Application '{app}' is not recorded, reinstall it to update it")
+            return None
 
-                # Install the dependencies of the dependency
-                installed_dependencies.add(depend)
-                installed_dependencies.union(
-                    self._install_dependencies(package, app_dir,
-                                               installed_dependencies))
+        self._runtimes = [Runtime(name) for name in record["runtimes"].split(",") if name]
+        installed = {row["name"]: row for row in self._state.packages(app)}
+
+        try:
+            plan = self.resolve(record["target"])
+        except ResolveError as e:
+            print(f"Failed to resolve '{app}': {e}")
+            return None
+
+        if not plan:
+            return None
+
+        changed = [
+            package for package in plan.packages
+            if package.name not in installed
+            or installed[package.name]["version"] != package.version
+            or (package.sha256sum and installed[package.name]["sha256sum"] != package.sha256sum)
+        ]
+
+        names = {package.name for package in plan.packages}
+        removed = [name for name in installed if name not in names]
+
+        if not changed and not removed:
+            print(f"{app} is up to date")
+            return None
+
+        print(f"Updates for \x1b[91m{app}\x1b[0m:")
+
+        for package in changed:
+            old = installed[package.name]["version"] if package.name in installed else "(new)"
+            print(f"  {package.repo}/{package.name} {old} -> {package.version}")
+
+        for name in removed:
+            print(f"  {name} {installed[name]['version']} -> (removed)")
+
+        return app, record, plan, changed, removed
+
+    def _apply_update(self, app: str, record: Row, plan: Plan,
+                      changed: List[Package], removed: List[str]) -> None:
+        app_dir = record["path"]
+        self._runtimes = [Runtime(name) for name in record["runtimes"].split(",") if name]
+
+        old_files = self._state.files(app)
+
+        try:
+            new_files = self._download_packages(changed, app_dir)
+        except ChecksumError as e:
+            print(f"Checksum mismatch for {e}")
+            return
+        except DownloadError as e:
+            print(e)
+            return
+
+        files = {package.name: new_files.get(package.name, old_files.get(package.name, []))
+                 for package in plan.packages}
+
+        self._remove_stale(app_dir, old_files, files,
+                           [package.name for package in changed] + removed)
+
+        # Nothing is left of a removed package for pharaoh verify to check
+        for name in removed:
+            try:
+                os.remove(mtree_path(app_dir, name))
+            except FileNotFoundError:
+                pass
+
+        stage_etc(app_dir)
+        generate_ld_cache(app_dir, [runtime.path for runtime in self._runtimes])
+        bump_generation(app_dir)
+
+        entry = self._find_entry(files[plan.target.name])
+        self._export_package(app, app_dir, entry)
+
+        if entry:
+            self._create_desktop_entry(app, app_dir, entry)
+
+        linked, saved = self._store.deduplicate(app, app_dir)
+        print(f"Deduplicated {linked} files, saved {saved / (1024 * 1024):.2f} MiB")
+
+        self._state.record(app=app, path=app_dir, target=plan.target,
+                           packages=plan.packages, files=files,
+                           exports=self._exporter.exports(app),
+                           runtimes=[runtime.name for runtime in self._runtimes])
+
+        print(f"Updated \x1b[91m{app}\x1b[0m")
+
+    def _remove_stale(self, app_dir: str, old_files: Dict[str, List[str]],
+                      files: Dict[str, List[str]], replaced: List[str]) -> None:
+        keep = set().union(*files.values())
+        stale = {path for name in replaced for path in old_files.get(name, [])
+                 if path not in keep}
+
+        # Children sort after their parents, so walking backwards empties directories first
+        for path in sorted(stale, reverse=True):
+            target = f"{app_dir}/{path}"
+
+            if os.path.isdir(target) and not os.path.islink(target):
+                try:
+                    os.rmdir(target)
+                except OSError:
+                    continue
+            elif os.path.lexists(target):
+                os.unlink(target)
             else:
-                print(f"Failed to find dependency: '{depend}'")
+                continue
+
+            # Archives don't always list their directories, drop the ones left empty
+            parent = os.path.dirname(path)
+
+            while parent and parent not in keep:
+                try:
+                    os.rmdir(f"{app_dir}/{parent}")
+                except OSError:
+                    break
+
+                parent = os.path.dirname(parent)
+
+    def install_runtime(self, name: str, package_names: List[str],
+                        dry_run: bool = False) -> None:
+        runtime = Runtime(name)
+        packages = []
+
+        for package_name in package_names:
+            package = self._find_package(package_name)
+
+            if not package:
+                print(f"Failed to find package: '{package_name}'")
+                return
 
-        return installed_dependencies
+            packages.append(package)
+
+        # A runtime only builds on the host, never on another runtime
+        self._runtimes = []
+
+        try:
+            plan = self._resolver.resolve(packages[0], extra=packages[1:])
+        except ResolveError as e:
+            print(f"Failed to resolve runtime '{name}': {e}")
+            return
+
+        plan.print()
+
+        if dry_run:
+            return
+
+        os.makedirs(runtime.path, exist_ok=True)
+
+        try:
+            self._download_packages(plan.packages, runtime.path)
+        except ChecksumError as e:
+            print(f"Checksum mismatch for {e}")
+            return
+        except DownloadError as e:
+            print(e)
+            return
+        finally:
+            self._mirrors.save()
+
+        runtime.record(plan.packages)
+        bump_generation(f"{runtime.path}/.pharaoh")
+
+        linked, saved = self._store.deduplicate(runtime.ref, runtime.path)
+        print(f"Deduplicated {linked} files, saved {saved / (1024 * 1024):.2f} MiB")
+
+        self._refresh_ld_caches(runtime)
+        self._cache.evict()
+
+    def _refresh_ld_caches(self, runtime: Runtime) -> None:
+        # The apps' caches point into the /usr/lib overlay this runtime just replaced
+        for record in self._state.apps():
+            runtimes = [name for name in record["runtimes"].split(",") if name]
+
+            if runtime.name not in runtimes:
+                continue
+
+            print(f"Regenerating the linker cache of \x1b[91m{record['name']}\x1b[0m")
+            generate_ld_cache(record["path"], [Runtime(name).path for name in runtimes])
 
     def _install_package(self, package: Package, app_dir: str) -> None:
         entry = DesktopEntry.from_desktop_entry(
-            f"{EXPORT_DIRECTORY}/applications/{package.entry}")
+            f"{app_dir}/usr/share/applications/{package.entry}")
 
         package_entry = DesktopEntry.from_desktop_entry(
-            f"/var/lib/pharaoh/app/{package.name}/usr/share/applications/{package.entry}"
+            f"{app_dir}/usr/share/applications/{package.entry}"
         )
 
         permission_path = f"{app_dir}/{package.name}.json"
+
+        # Compiled once here, launches only hand the cached program to bwrap
+        seccomp = {"presets": ["default"]}
+        seccomp_filter = SeccompCache().get(SeccompPolicy.from_dict(seccomp))
+
         executable = package_entry._exec.split(" ")[0].split("/")[-1]
 
         config = ConfigBuilder(
@@ -166,6 +511,9 @@ class PackageManager:
             executable=f"{app_dir}/usr/bin/{executable}",
             path=app_dir,
             entry=entry,
+            seccomp=seccomp,
+            seccomp_filter=seccomp_filter,
+            runtimes=[runtime.name for runtime in self._runtimes],
             dbus_app=f"org.Pharaoh.{package.name}",
             dbus_permissions=DBusPermissions(DBusPermissionList.Notifications),
             permissions=Permissions(PermissionList.Dri | PermissionList.Dbus
@@ -175,87 +523,50 @@ class PackageManager:
 
         config.build(path=permission_path)
 
-        sandboxed_desktop_entry_factory(package=package.name,
-                                        entry_name=package.entry,
-                                        script=f"pharaoh run {package.name}")
+        self._create_desktop_entry(package.name, app_dir, package.entry)
 
-    def _package_package(self, package: Package, app_dir: str) -> None:
-        os.makedirs(app_dir, exist_ok=True)
-        self._decompress_package(package,
-                                 app_dir=app_dir,
-                                 export_dir=EXPORT_DIRECTORY)
-
-    def _download_package(self, package: Package) -> None:
-        mirror = random.choice(self._mirrors)
-        repo = mirror.url.replace("$repo", package.repo)
-        url = f"{repo}/{package.filename}"
-
-        r = requests.get(url, stream=True)
-        with open(package.filename, 'wb') as f:
-            total_length = r.headers.get('content-length')
-            total_length = int(total_length)
-            chunk_size = 1024
-            with tqdm(total=total_length, unit='B', unit_scale=True, desc=package.filename) as pbar:
-                for chunk in r.iter_content(chunk_size=chunk_size):
-                    if chunk:
-                        f.write(chunk)
-                        f.flush()
-                        pbar.update(len(chunk))
-
-    def _decompress_package(self, package: Package, app_dir: str,
-                            export_dir: str) -> None:
-        input_file = pathlib.Path(package.filename)
-        output_path = pathlib.Path(app_dir) / input_file.stem
-
-        with open(input_file, 'rb') as compressed:
-            decomp = zstd.ZstdDecompressor()
-            with open(output_path, 'wb') as destination:
-                decomp.copy_stream(compressed, destination)
-
-        with tarfile.open(output_path, 'r') as tar:
-            tar.extractall(path=app_dir)
-
-        os.remove(input_file)
-        os.remove(output_path)
-
-        entry = os.listdir(f"{app_dir}/usr/share/applications")[0]
-        package._entry = entry
+    def _create_desktop_entry(self, app: str, app_dir: str, entry: str) -> None:
+        # Never write over the sandboxed entry of another app with the same name
+        if f"applications/{entry}" not in self._exporter.exports(app):
+            print(f"'{entry}' is exported by another app, not creating a desktop entry")
+            return
 
-        try:
-            shutil.copytree(f"{app_dir}/usr/share",
-                            export_dir,
-                            dirs_exist_ok=True)
-        except shutil.Error:
-            pass
+        sandboxed_desktop_entry_factory(package=app, app_dir=app_dir, entry_name=entry,
+                                        script=f"pharaoh run {app}")
+
+    def _download_packages(self, packages: List[Package],
+                           app_dir: str) -> Dict[str, List[str]]:
+        # Packages are extracted straight off the response while they download
+        return self._downloader.extract(packages, destination=app_dir)
+
+    def _find_entry(self, files: List[str]) -> Optional[str]:
+        for file in files:
+            if file.startswith("usr/share/applications/") and file.endswith(".desktop"):
+                return os.path.basename(file)
+
+        return None
+
+    def _export_package(self, app: str, app_dir: str, entry: Optional[str]) -> None:
+        generated = [f"applications/{entry}"] if entry else []
+        added, removed = self._exporter.export(app, app_dir, generated)
+        print(f"Exported {added} new files, removed {removed} stale exports")
 
     def _fetch_mirrors(self) -> None:
 
         mirrors = []
 
-        with open("/etc/pacman.d/mirrorlist") as fp:
+        with open(MIRRORLIST) as fp:
             for mirror_str in fp:
                 if "Server = " in mirror_str and not "#" in mirror_str:
                     mirrors.append(Mirror.from_str(mirror_str.strip()))
 
         return mirrors
 
-    def _is_installed(self, package) -> bool:
-        if ".so" in package:
+    def _is_installed(self, depend: Dependency) -> bool:
+        if self._local_database.satisfies(depend):
             return True
 
-        try:
-            result = subprocess.check_output(['pacman', '-Qq', package
-                                              ]).decode("utf-8").strip()
-            return result == package
-        except subprocess.CalledProcessError:
-            return False
-
-    def _find_package(self, package) -> None:
-        for repo in REPOS:
-            try:
-                r = requests.get(
-                    f"https://archlinux.org/packages/{repo}/x86_64/{package}/json/"
-                ).json()
-                return Package.from_dict(r)
-            except requests.exceptions.JSONDecodeError:
-                continue
+        return any(runtime.satisfies(depend) for runtime in self._runtimes)
+
+    def _find_package(self, package) -> Optional[Package]:
+        return self._database.find(package)
@@ -1,58 +1,37 @@
-import os, fcntl, subprocess, pathlib
-from typing import Optional
+import os, sys, shlex
+from typing import Dict, List, Optional, Self, Tuple, TYPE_CHECKING
 
-from src import APPLICATION_DIRECTORY, APPLICATION_HOME_DIRECTORY
-from src.permissions import Permissions, DBusPermissionList, PermissionList
+from src import APPLICATION_HOME_DIRECTORY, RUNTIME_DIRECTORY
+from src.etc import ETC_HOST_FILES, ETC_HOST_DIRECTORIES, etc_host_binds, ld_cache_path, staged_etc_path
+from src.permissions import Permissions, DBusPermissions, DBusPermissionList, PermissionList
+from src.proxy import DBusProxyManager
+from src.plan import LaunchPlan, plan_key, read_generation
 
+if TYPE_CHECKING:
+    from src.config import Config
 
-class XdgDbusProxy:
+BWRAP = "/bin/bwrap"
 
-    def __init__(self, app: str, permissions: Permissions) -> None:
-        self._app = app
-        self._permissions = permissions
+OVERLAY_PATHS = ["/usr/bin", "/usr/lib", "/usr/share"]
 
-        self._command = ["/usr/bin/xdg-dbus-proxy"]
-        self._xdg_runtime_dir = os.environ['XDG_RUNTIME_DIR']
 
-    def _set_permissions(self) -> None:
+def overlay_arguments(layers: List[str], paths: List[str] = OVERLAY_PATHS) -> List[str]:
+    arguments = []
 
-        self._command.append(f"--own={self._app}.*")
+    for path in paths:
+        # The argv ends up in the plan's cache key, so no doubled slashes
+        sources = [os.path.normpath(os.path.join(layer, path.lstrip("/"))) for layer in layers]
+        sources = [source for source in sources if os.path.exists(source)]
 
-        self._command.append("--filter")
-        self._command.append("--talk=org.freedesktop.portal.Desktop")
-        """
-        if self._permissions.has_permission(DBusPermissionList.Notifications):
-            self._command.append("--talk=org.freedesktop.portal.Notification")
-        if self._permissions.has_permission(DBusPermissionList.Screencast):
-            self._command.append("--talk=org.freedesktop.portal.Screencast")
-        if self._permissions.has_permission(DBusPermissionList.Screenshot):
-            self._command.append("--talk=org.freedesktop.portal.Screenshot")
-        """
+        if sources:
+            arguments.extend(["--overlay-src", path])
 
-    def _set_dbus_proxy_socket(self) -> None:
-        dbus_session_bus_address = os.environ['DBUS_SESSION_BUS_ADDRESS']
+            for source in sources:
+                arguments.extend(["--overlay-src", source])
 
-        self._command.append(
-            f"{dbus_session_bus_address} {self._xdg_runtime_dir}/xdg-dbus-proxy/{self._app}.sock"
-        )
+            arguments.extend(["--ro-overlay", path])
 
-    def launch(self) -> int:
-
-        self._set_dbus_proxy_socket()
-        self._set_permissions()
-
-        args = " ".join(arg for arg in self._command)
-        print(args)
-        print("------------------")
-
-        os.system(f"mkdir -p {self._xdg_runtime_dir}/xdg-dbus-proxy")
-
-        pid = os.fork()
-
-        if not pid:
-            os.execl(self._command[0], *args.split(" "))
-
-        return pid
+    return arguments
 
 
 class SandboxLauncher:
@@ -64,48 +43,71 @@ class SandboxLauncher:
             path: str,
             permissions: Permissions,
             seccomp_filter: Optional[str] = None,
+            seccomp_policy: Optional[Dict] = None,
             dbus_app: Optional[str] = None,
-            dbus_permissions: Optional[DBusPermissionList] = None) -> None:
+            dbus_permissions: Optional[DBusPermissionList] = None,
+            runtimes: Optional[List[str]] = None,
+            environ: Optional[Dict[str, str]] = None) -> None:
         self.executable = executable
         self.app = app
         self.path = path
         self.permissions = permissions
         self.seccomp_filter = seccomp_filter
+        self.seccomp_policy = seccomp_policy
         self.dbus_app = dbus_app
         self.dbus_permissions = dbus_permissions
-
-        self.command = ["/bin/bwrap"]
-
-        self.wayland_display = os.environ.get('WAYLAND_DISPLAY')
-        self.xauthority = os.environ.get('XAUTHORITY')
-        self.xdg_runtime_dir = os.environ['XDG_RUNTIME_DIR']
-        self.xdg_data_dirs = os.environ.get('XDG_DATA_DIRS')
-        self.display = os.environ.get('DISPLAY')
-        self.home = os.environ['HOME']
-        self.user = os.environ['USER']
-
-        self.app_dir = f"{APPLICATION_DIRECTORY}/{self.app}"
-
-        self.seccomp_fd = None
-        self.xdg_proxy_pid = None
+        self.runtimes = runtimes or []
+
+        self.command = [BWRAP]
+        self.env = {}
+        self.directories = []
+
+        # The caller's session, pharaohd launches with the environment of the client
+        self.environ = os.environ if environ is None else environ
+
+        self.wayland_display = self.environ.get('WAYLAND_DISPLAY')
+        self.xauthority = self.environ.get('XAUTHORITY')
+        self.xdg_runtime_dir = self.environ['XDG_RUNTIME_DIR']
+        self.xdg_data_dirs = self.environ.get('XDG_DATA_DIRS')
+        self.display = self.environ.get('DISPLAY')
+        self.home = self.environ['HOME']
+        self.user = self.environ['USER']
+
+        self.app_dir = self.path.rstrip("/")
+        self.config_path = f"{self.app_dir}/{self.app}.json"
+
+
+    @classmethod
+    def from_config(cls, config: "Config",
+                    environ: Optional[Dict[str, str]] = None) -> Self:
+        return cls(executable=config.executable,
+                   app=config.app,
+                   path=config.path,
+                   permissions=config.permissions,
+                   seccomp_filter=config.seccomp_filter,
+                   seccomp_policy=config.seccomp,
+                   dbus_app=config.dbus_app,
+                   dbus_permissions=config.dbus_permissions,
+                   runtimes=config.runtimes,
+                   environ=environ)
 
     def _bind(self, source: str, dest: Optional[str] = None) -> None:
         dest = dest if dest else source
-        self.command.append(f"--bind-try {source} {dest}")
+        self.command.extend(["--bind-try", source, dest])
 
     def _ro_bind(self, source: str, dest: Optional[str] = None) -> None:
         dest = dest if dest else source
-        self.command.append(f"--ro-bind-try {source} {dest}")
+        self.command.extend(["--ro-bind-try", source, dest])
 
     def _dev_bind(self, source: str, dest: Optional[str] = None) -> None:
         dest = dest if dest else source
-        self.command.append(f"--dev-bind-try {source} {dest}")
+        self.command.extend(["--dev-bind-try", source, dest])
 
     def _set_env(self, env: str, value: str) -> None:
-        self.command.append(f"--setenv {env} {value}")
+        self.env[env] = value
 
     def _tmpfs_bind(self, path: str) -> None:
-        self.command.append(f"--tmpfs {path}")
+        self.command.extend(["--tmpfs", path])
 
     def _set_ipc_permission(self) -> None:
         if not self.permissions.has_permission(PermissionList.Ipc):
@@ -119,14 +121,24 @@ class SandboxLauncher:
         self.command.append("--new-session")
 
     def _bind_etc_paths(self) -> None:
-        etc_bind_paths = [
-            "/etc/ssl/certs/ca-bundle.crt",
-            "/etc/ssl/certs/ca-certificates.crt", "/etc/resolv.conf",
-            "/etc/hosts", "/etc/ld.so.preload", "/etc/ld.so.conf",
-            "/etc/ld.so.cache", "/etc/ld.so.conf.d", "/etc/fonts", "/etc/passwd", "/etc/locale.conf"
-        ]
-
-        for path in etc_bind_paths:
+        staged = staged_etc_path(self.path)
+
+        # Apps installed before /etc staging existed still get one bind per file
+        if not os.path.isdir(staged):
+            self._bind_etc_files()
+            return
+
+        self._ro_bind(source=staged, dest="/etc")
+
+        for path in etc_host_binds(self.path):
+            # The app's own linker cache also knows about the libraries it brings
+            if path == "/etc/ld.so.cache" and os.path.exists(ld_cache_path(self.path)):
+                self._ro_bind(source=ld_cache_path(self.path), dest=path)
+            else:
+                self._ro_bind(path)
+
+    def _bind_etc_files(self) -> None:
+        for path in ETC_HOST_FILES + ETC_HOST_DIRECTORIES:
             self._ro_bind(path)
 
         # bind the etc directory too
@@ -141,12 +153,12 @@ class SandboxLauncher:
         for path in fs_bind_paths:
             self._ro_bind(path)
 
-        self.command.append("--dev /dev")
-        self.command.append("--proc /proc")
+        self.command.extend(["--dev", "/dev"])
+        self.command.extend(["--proc", "/proc"])
 
         self._tmpfs_bind("/tmp")
 
-        self.command.append(f"--tmpfs /run --dir {self.xdg_runtime_dir}")
+        self.command.extend(["--tmpfs", "/run", "--dir", self.xdg_runtime_dir])
 
     def _set_display(self) -> None:
         if self.display:
@@ -185,13 +197,11 @@ class SandboxLauncher:
         else:
             app_dir = f"{APPLICATION_HOME_DIRECTORY}/{self.app}"
 
-            if not os.path.exists(app_dir):
-                os.makedirs(app_dir)
-                pathlib.Path(app_dir + "/.flatpak-info").touch()
-
-            self._bind(source=app_dir, dest=self.home)
+            # Created on every launch, the plan only remembers that it is needed
+            self.directories.append(str(app_dir))
+            self._bind(source=str(app_dir), dest=self.home)
 
-    def _launch_xdg_dbus_proxy(self) -> Optional[int]:
+    def _bind_xdg_dbus_proxy(self) -> None:
         if self.permissions.has_permission(PermissionList.Dbus):
             xdg_socket_path = f"{self.xdg_runtime_dir}/xdg-dbus-proxy/{self.dbus_app}.sock"
             self._ro_bind(source=xdg_socket_path, dest="/run/user/1000/bus")
@@ -201,8 +211,18 @@ class SandboxLauncher:
             self._set_env("DBUS_SESSION_BUS_ADDRESS",
                           "unix:path=/run/user/1000/bus")
 
-            return XdgDbusProxy(app=self.dbus_app,
-                                permissions=self.dbus_permissions).launch()
+    def _launch_xdg_dbus_proxy(self, plan: LaunchPlan) -> Optional[int]:
+        if not plan.dbus_app:
+            return None
+
+        # The proxy is shared by every sandbox of the app and outlives this launch,
+        # bwrap holds the lease for the lifetime of the sandbox
+        lease = DBusProxyManager(app=plan.dbus_app,
+                                 permissions=DBusPermissions(plan.dbus_permissions),
+                                 environ=self.environ).acquire()
+
+        os.set_inheritable(lease, True)
+        return lease
 
     def _set_misc(self) -> None:
         self._set_env("GTK_THEME", "Adwaita:dark")
@@ -212,18 +232,41 @@ class SandboxLauncher:
             self._set_env("XDG_DATA_DIRS", self.xdg_data_dirs)
 
     def _bind_overlays(self):
-        paths = ["/usr/bin", "/usr/lib", "/usr/share"]
+        # Host first, then the shared runtimes, the app itself ends up on top
+        layers = [f"{RUNTIME_DIRECTORY}{runtime}" for runtime in self.runtimes]
+        layers.append(self.app_dir)
 
-        for path in paths:
-            if os.path.exists(f"{self.app_dir}/{path}"):
-                self.command.append(f"--overlay-src {path}")
-                self.command.append(f"--overlay-src {self.app_dir}/{path}")
-                self.command.append(f"--ro-overlay {path}")
+        self.command.extend(overlay_arguments(layers))
 
         # Symlink /usr/bin to /bin
-        self.command.append("--symlink /usr/bin /bin")
+        self.command.extend(["--symlink", "/usr/bin", "/bin"])
+
+    def _plan_key(self) -> str:
+        generations = [read_generation(self.app_dir)]
+        generations.extend(read_generation(f"{RUNTIME_DIRECTORY}{runtime}/.pharaoh")
+                           for runtime in self.runtimes)
+
+        return plan_key(self.config_path, generations, self.environ)
+
+    def _plan_paths(self) -> List[str]:
+        # Root can keep plans next to the config, users get a private copy
+        # that the sandbox itself never sees
+        return [f"{self.app_dir}/{self.app}.plan.json",
+                f"{self.xdg_runtime_dir}/pharaoh/{self.app}.plan.json"]
+
+    def _compile_seccomp(self) -> None:
+        if not self.seccomp_policy:
+            return
+
+        # Only needed when the plan is rebuilt, launches just open the cached blob
+        from src.seccomp import SeccompCache, SeccompPolicy
+
+        policy = SeccompPolicy.from_dict(self.seccomp_policy)
+        self.seccomp_filter = SeccompCache().get(policy)
+
+    def compile(self, key: Optional[str] = None) -> LaunchPlan:
+        self._compile_seccomp()
 
-    def launch(self) -> None:
         self._set_security_isolation()
         self._set_ipc_permission()
 
@@ -238,36 +281,93 @@ class SandboxLauncher:
 
         self._set_misc()
 
-        xdg_dbus_proxy_pid = self._launch_xdg_dbus_proxy()
+        self._bind_xdg_dbus_proxy()
         self._ro_bind(self.path)
 
         # Bind the mounts
         self._bind_overlays()
 
-        if self.seccomp_filter:
-            fd = open(self.seccomp_filter, "r")
-            self.seccomp_fd = os.dup(fd.fileno())
-            fcntl.fcntl(
-                self.seccomp_fd, fcntl.F_SETFD,
-                fcntl.fcntl(self.seccomp_fd, fcntl.F_GETFD)
-                & ~fcntl.FD_CLOEXEC)
+        has_dbus = self.permissions.has_permission(PermissionList.Dbus)
+
+        return LaunchPlan(
+            key=key or self._plan_key(),
+            argv=self.command,
+            env=self.env,
+            # executable but strip the base path
+            executable=self.executable.replace(self.app_dir, ""),
+            seccomp_filter=self.seccomp_filter,
+            dbus_app=self.dbus_app if has_dbus else None,
+            dbus_permissions=int(self.dbus_permissions) if has_dbus and self.dbus_permissions else 0,
+            directories=self.directories)
+
+    def plan(self) -> LaunchPlan:
+        key = self._plan_key()
+
+        for path in self._plan_paths():
+            plan = LaunchPlan.load(path, key)
+
+            if plan:
+                return plan
+
+        plan = self.compile(key)
+
+        for path in self._plan_paths():
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                plan.save(path)
+                break
+            except PermissionError:
+                continue
+
+        return plan
 
-            self.command.append(f"--seccomp {self.seccomp_fd}")
+    def _prepare(self, plan: LaunchPlan) -> Tuple[List[str], List[int]]:
+        for directory in plan.directories:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+                open(directory + "/.flatpak-info", "a").close()
 
-        # executable but strip the base path
-        self.command.append(self.executable.replace(self.app_dir, ""))
+        # Before the seccomp fd exists, a freshly started proxy must not inherit it
+        sync_fd = self._launch_xdg_dbus_proxy(plan)
+        seccomp_fd = None
 
-        command_args = " ".join(arg for arg in self.command[1:])
-        print(self.command[0], command_args)
+        if plan.seccomp_filter:
+            try:
+                seccomp_fd = os.open(plan.seccomp_filter, os.O_RDONLY)
+            except BaseException:
+                if sync_fd is not None:
+                    os.close(sync_fd)
+                raise
+
+            os.set_inheritable(seccomp_fd, True)
+
+        command = plan.command(seccomp_fd)
+
+        if sync_fd is not None:
+            command[1:1] = ["--sync-fd", str(sync_fd)]
+
+        print(shlex.join(command))
         print("------------------")
 
-        if self.seccomp_fd:
-            subprocess.check_output(f"{self.command[0]} {command_args}",
-                                    shell=True,
-                                    pass_fds=[self.seccomp_fd])
-        else:
-            subprocess.check_output(f"{self.command[0]} {command_args}",
-                                    shell=True)
+        # Returned rather than kept on the launcher, the daemon runs several launches
+        # of one app at once
+        return command, [fd for fd in (seccomp_fd, sync_fd) if fd is not None]
+
+    def exec(self) -> None:
+        command, _ = self._prepare(self.plan())
+
+        # Hand the process over to bwrap, nothing of pharaoh stays resident. execv
+        # drops whatever is still buffered when stdout is a pipe or the journal
+        sys.stdout.flush()
+        os.execv(command[0], command)
+
+    def launch(self) -> int:
+        command, pass_fds = self._prepare(self.plan())
+
+        import subprocess
 
-        if xdg_dbus_proxy_pid:
-            os.kill(xdg_dbus_proxy_pid, 9)
+        try:
+            return subprocess.run(command, pass_fds=pass_fds).returncode
+        finally:
+            for fd in pass_fds:
+                os.close(fd)
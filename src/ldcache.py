@@ -0,0 +1,54 @@
+import os, shutil, subprocess
+from typing import List
+
+from src.etc import etc_host_binds, ld_cache_path, staged_etc_path
+from src.launch import BWRAP, overlay_arguments
+
+# Where the cache is written inside the build sandbox
+OUTPUT_DIRECTORY = "/run/pharaoh"
+
+
+def ld_cache_command(path: str, layers: List[str]) -> List[str]:
+    ldconfig = os.path.realpath(shutil.which("ldconfig") or "/usr/bin/ldconfig")
+
+    command = [BWRAP, "--ro-bind", "/usr", "/usr",
+               "--ro-bind-try", "/lib", "/lib", "--ro-bind-try", "/lib64", "/lib64"]
+
+    # Same library view the app gets at launch, host, runtimes, then the app
+    command.extend(overlay_arguments(layers + [path], ["/usr/lib"]))
+
+    command.extend(["--ro-bind", staged_etc_path(path), "/etc"])
+
+    if "/etc/ld.so.conf" in etc_host_binds(path):
+        command.extend(["--ro-bind-try", "/etc/ld.so.conf", "/etc/ld.so.conf"])
+
+    command.extend(["--tmpfs", "/run",
+                    "--bind", os.path.dirname(ld_cache_path(path)), OUTPUT_DIRECTORY])
+
+    # -X leaves the soname symlinks of the read-only tree alone
+    command.extend([ldconfig, "-X", "-C", f"{OUTPUT_DIRECTORY}/ld.so.cache.tmp"])
+    return command
+
+
+def generate_ld_cache(path: str, layers: List[str]) -> bool:
+    output = ld_cache_path(path)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    try:
+        result = subprocess.run(ld_cache_command(path, layers),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    except FileNotFoundError as e:
+        print(f"Not generating a linker cache: {e}")
+        return False
+
+    if result.returncode != 0 or not os.path.exists(f"{output}.tmp"):
+        print(f"Not generating a linker cache: {result.stderr.strip()}")
+
+        # Better the host cache than one that is missing the app's libraries
+        if os.path.exists(output):
+            os.remove(output)
+
+        return False
+
+    os.replace(f"{output}.tmp", output)
+    return True
@@ -0,0 +1,169 @@
+import os, json, time, threading, requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, TYPE_CHECKING
+
+from src import MIRROR_SCORES, REPOS
+
+if TYPE_CHECKING:
+    from src.fetch import Mirror
+
+PROBE_TIMEOUT = 5
+PROBE_INTERVAL = 24 * 60 * 60
+PROBE_WORKERS = 16
+
+# Weight of a new sample in the moving averages
+SMOOTHING = 0.3
+# Failures are forgotten with this half life (seconds)
+FAILURE_HALF_LIFE = 60 * 60
+
+# Mirrors are ranked by the estimated time to fetch this many bytes
+REFERENCE_SIZE = 4 * 1024 * 1024
+
+
+class MirrorStats:
+
+    __slots__ = ("latency", "throughput", "failures", "updated", "probed")
+
+    def __init__(self, latency: float = None, throughput: float = None,
+                 failures: float = 0, updated: float = 0, probed: float = 0) -> None:
+        self.latency = latency
+        self.throughput = throughput
+        self.failures = failures
+        self.updated = updated
+        self.probed = probed
+
+    def _failures(self, now: float) -> float:
+        if not self.failures or not self.updated:
+            return self.failures
+
+        return self.failures * 0.5 ** ((now - self.updated) / FAILURE_HALF_LIFE)
+
+    def decay(self, now: float) -> None:
+        self.failures = self._failures(now)
+        self.updated = now
+
+    def score(self, now: float) -> float:
+        if self.latency is None:
+            return float("inf")
+
+        estimate = self.latency
+
+        if self.throughput:
+            estimate += REFERENCE_SIZE / self.throughput
+
+        return estimate * (1 + self._failures(now))
+
+    def to_dict(self) -> Dict[str, float]:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+def _average(old: float, new: float) -> float:
+    return new if old is None else old * (1 - SMOOTHING) + new * SMOOTHING
+
+
+class MirrorManager:
+
+    def __init__(self, mirrors: List["Mirror"], path: str = MIRROR_SCORES) -> None:
+        self._mirrors = mirrors
+        self._path = path
+        self._lock = threading.Lock()
+        self._stats = {mirror.url: MirrorStats() for mirror in mirrors}
+
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._mirrors)
+
+    @property
+    def mirrors(self) -> List["Mirror"]:
+        return self._mirrors
+
+    def _load(self) -> None:
+        try:
+            with open(self._path) as fp:
+                data = json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        for url, values in data.items():
+            if url in self._stats:
+                self._stats[url] = MirrorStats(**values)
+
+    def save(self) -> None:
+        with self._lock:
+            data = {url: stats.to_dict() for url, stats in self._stats.items()}
+
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+
+            with open(f"{self._path}.tmp", "w") as fp:
+                json.dump(data, fp, indent=4)
+
+            os.replace(f"{self._path}.tmp", self._path)
+        except PermissionError:
+            pass
+
+    def ranked(self) -> List["Mirror"]:
+        now = time.time()
+
+        with self._lock:
+            scores = {url: stats.score(now) for url, stats in self._stats.items()}
+
+        # sorted() is stable, unknown mirrors keep their mirrorlist order
+        return sorted(self._mirrors, key=lambda mirror: scores[mirror.url])
+
+    def record_success(self, mirror: "Mirror", size: int, elapsed: float) -> None:
+        with self._lock:
+            stats = self._stats[mirror.url]
+            stats.decay(time.time())
+
+            if elapsed > 0 and size:
+                stats.throughput = _average(stats.throughput, size / elapsed)
+
+    def record_latency(self, mirror: "Mirror", latency: float) -> None:
+        with self._lock:
+            stats = self._stats[mirror.url]
+            stats.decay(time.time())
+            stats.latency = _average(stats.latency, latency)
+
+    def record_failure(self, mirror: "Mirror") -> None:
+        with self._lock:
+            stats = self._stats[mirror.url]
+            stats.decay(time.time())
+            stats.failures += 1
+
+            # A mirror that never answered still has to sort behind the others
+            if stats.latency is None:
+                stats.latency = PROBE_TIMEOUT
+
+    def probe(self, force: bool = False) -> None:
+        now = time.time()
+        stale = [
+            mirror for mirror in self._mirrors
+            if force or now - self._stats[mirror.url].probed > PROBE_INTERVAL
+        ]
+
+        if not stale:
+            return
+
+        with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as pool:
+            list(pool.map(self._probe, stale))
+
+        self.save()
+
+    def _probe(self, mirror: "Mirror") -> None:
+        repo = REPOS[0]
+        url = f"{mirror.url.replace('$repo', repo)}/{repo}.db"
+
+        start = time.monotonic()
+
+        try:
+            r = requests.head(url, timeout=PROBE_TIMEOUT, allow_redirects=True)
+            r.raise_for_status()
+        except requests.exceptions.RequestException:
+            self.record_failure(mirror)
+        else:
+            self.record_latency(mirror, time.monotonic() - start)
+
+        with self._lock:
+            self._stats[mirror.url].probed = time.time()
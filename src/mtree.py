@@ -0,0 +1,150 @@
+import os, re, gzip, stat, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from src import EXTRACT_WORKERS
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Package metadata that lives next to usr/ in the archive root
+METADATA_FILES = (".PKGINFO", ".BUILDINFO", ".MTREE", ".INSTALL", ".CHANGELOG")
+
+ESCAPE = re.compile(rb"\\([0-7]{3})")
+
+
+def unescape(value: bytes) -> str:
+    return ESCAPE.sub(lambda match: bytes([int(match.group(1), 8)]), value).decode(
+        "utf-8", "surrogateescape")
+
+
+class MtreeEntry:
+
+    __slots__ = ("path", "type", "mode", "uid", "gid", "size", "sha256", "link")
+
+    def __init__(self, path: str, fields: Dict[str, str]) -> None:
+        self.path = path
+        self.type = fields.get("type", "file")
+        self.mode = int(fields["mode"], 8) if "mode" in fields else None
+        self.uid = int(fields.get("uid", 0))
+        self.gid = int(fields.get("gid", 0))
+        self.size = int(fields["size"]) if "size" in fields else None
+        self.sha256 = fields.get("sha256digest")
+        self.link = unescape(fields["link"].encode()) if "link" in fields else None
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, MtreeEntry):
+            return NotImplemented
+
+        return all(getattr(self, key) == getattr(other, key) for key in self.__slots__)
+
+    def matches(self, st: os.stat_result) -> bool:
+        # What lstat can tell without reading the file
+        if self.type == "file":
+            return (stat.S_ISREG(st.st_mode) and st.st_size == self.size
+                    and self.mode in (None, stat.S_IMODE(st.st_mode)))
+
+        if self.type == "link":
+            return stat.S_ISLNK(st.st_mode)
+
+        return stat.S_ISDIR(st.st_mode)
+
+
+def parse_mtree(data: bytes) -> Dict[str, MtreeEntry]:
+    if data.startswith(GZIP_MAGIC):
+        data = gzip.decompress(data)
+
+    entries = {}
+    defaults = {}
+
+    for line in data.splitlines():
+        if not line or line.startswith(b"#"):
+            continue
+
+        words = line.split()
+        fields = dict(word.decode().split("=", 1) for word in words[1:] if b"=" in word)
+
+        if words[0] == b"/set":
+            defaults.update(fields)
+            continue
+
+        if words[0] == b"/unset":
+            for word in words[1:]:
+                defaults.pop(word.decode(), None)
+            continue
+
+        path = unescape(words[0]).removeprefix("./")
+
+        if path in METADATA_FILES or path == ".":
+            continue
+
+        entries[path] = MtreeEntry(path, {**defaults, **fields})
+
+    return entries
+
+
+def mtree_path(path: str, package: str) -> str:
+    # Next to usr/ like the rest of pharaoh's bookkeeping, never inside the sandbox
+    return f"{path}/.pharaoh/mtree/{package}"
+
+
+def load_mtree(path: str, package: str) -> Optional[Dict[str, MtreeEntry]]:
+    try:
+        with open(mtree_path(path, package), "rb") as fp:
+            return parse_mtree(fp.read())
+    except FileNotFoundError:
+        return None
+
+
+def save_mtree(path: str, package: str, data: bytes) -> None:
+    target = mtree_path(path, package)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    with open(f"{target}.tmp", "wb") as fp:
+        fp.write(data)
+
+    os.replace(f"{target}.tmp", target)
+
+
+def check_entry(path: str, entry: MtreeEntry) -> Optional[str]:
+    target = f"{path}/{entry.path}"
+
+    try:
+        st = os.lstat(target)
+    except FileNotFoundError:
+        return "missing"
+
+    if not entry.matches(st):
+        if entry.type == "file" and stat.S_ISREG(st.st_mode) and st.st_size == entry.size:
+            return "mode differs"
+
+        return "size differs" if entry.type == "file" and stat.S_ISREG(st.st_mode) \
+            else "type differs"
+
+    if entry.type == "link" and os.readlink(target) != entry.link:
+        return "link target differs"
+
+    if entry.type == "file" and entry.sha256:
+        with open(target, "rb") as fp:
+            if hashlib.file_digest(fp, "sha256").hexdigest() != entry.sha256:
+                return "checksum differs"
+
+    return None
+
+
+def verify(path: str) -> Tuple[int, List[Tuple[str, str, str]]]:
+    try:
+        packages = sorted(os.listdir(os.path.dirname(mtree_path(path, ""))))
+    except FileNotFoundError:
+        return 0, []
+
+    checks = [(package, entry) for package in packages
+              for entry in (load_mtree(path, package) or {}).values()]
+
+    # Hashing releases the GIL, big apps verify on every core
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as pool:
+        results = pool.map(lambda check: check_entry(path, check[1]), checks)
+
+        problems = [(package, entry.path, problem)
+                    for (package, entry), problem in zip(checks, results) if problem]
+
+    return len(checks), problems
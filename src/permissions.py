@@ -1,5 +1,7 @@
-from typing import Self, Dict
-from argparse import Namespace
+from typing import Self, Dict, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from argparse import Namespace
 
 
 class PermissionList:
@@ -115,7 +117,7 @@ class PermissionBuilder:
     def build(self) -> Permissions:
         return Permissions(permissions=self._permissions)
 
-    def from_args(self, args: Namespace) -> None:
+    def from_args(self, args: "Namespace") -> None:
         if args.dri:
             self.dri()
         if args.ipc:
@@ -168,7 +170,7 @@ class DBusPermissionBuilder:
     def build(self) -> DBusPermissions:
         return DBusPermissions(permissions=self._permissions)
 
-    def from_args(self, args: Namespace) -> None:
+    def from_args(self, args: "Namespace") -> None:
         if args.notifications:
             self.notifications()
         if args.screencast:
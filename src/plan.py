@@ -0,0 +1,145 @@
+import os, json, time, hashlib
+from typing import Dict, List, Optional, Self
+
+# Bump whenever SandboxLauncher changes the command line it generates
+PLAN_VERSION = 1
+
+# Host environment that ends up baked into the bwrap command line
+PLAN_ENVIRONMENT = ("WAYLAND_DISPLAY", "DISPLAY", "XAUTHORITY", "XDG_RUNTIME_DIR",
+                    "XDG_DATA_DIRS", "HOME", "USER")
+
+# What `pharaoh run` hands pharaohd, the daemon may not be in the caller's session
+LAUNCH_ENVIRONMENT = PLAN_ENVIRONMENT + ("DBUS_SESSION_BUS_ADDRESS",)
+
+
+def launch_environment(environ: Dict[str, str]) -> Dict[str, str]:
+    return {key: environ[key] for key in LAUNCH_ENVIRONMENT if key in environ}
+
+
+def bump_generation(path: str) -> None:
+    os.makedirs(path, exist_ok=True)
+
+    with open(f"{path}/.generation.tmp", "w") as fp:
+        fp.write(str(time.time_ns()))
+
+    os.replace(f"{path}/.generation.tmp", f"{path}/.generation")
+
+
+def read_generation(path: str) -> str:
+    try:
+        with open(f"{path}/.generation") as fp:
+            return fp.read().strip()
+    except FileNotFoundError:
+        return "0"
+
+
+def plan_key(config_path: str, generations: List[str],
+             environ: Optional[Dict[str, str]] = None) -> str:
+    environ = os.environ if environ is None else environ
+    st = os.stat(config_path)
+
+    data = {
+        "version": PLAN_VERSION,
+        "config": [st.st_ino, st.st_size, st.st_mtime_ns],
+        "generations": generations,
+        "environment": [environ.get(key) for key in PLAN_ENVIRONMENT],
+    }
+
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+class LaunchPlan:
+
+    def __init__(self, key: str, argv: List[str], env: Dict[str, str],
+                 executable: str, seccomp_filter: Optional[str] = None,
+                 dbus_app: Optional[str] = None, dbus_permissions: int = 0,
+                 directories: Optional[List[str]] = None) -> None:
+        self._key = key
+        self._argv = argv
+        self._env = env
+        self._executable = executable
+        self._seccomp_filter = seccomp_filter
+        self._dbus_app = dbus_app
+        self._dbus_permissions = dbus_permissions
+        self._directories = directories or []
+
+    @property
+    def key(self) -> str:
+        return self._key
+
+    @property
+    def argv(self) -> List[str]:
+        return self._argv
+
+    @property
+    def env(self) -> Dict[str, str]:
+        return self._env
+
+    @property
+    def executable(self) -> str:
+        return self._executable
+
+    @property
+    def seccomp_filter(self) -> Optional[str]:
+        return self._seccomp_filter
+
+    @property
+    def dbus_app(self) -> Optional[str]:
+        return self._dbus_app
+
+    @property
+    def dbus_permissions(self) -> int:
+        return self._dbus_permissions
+
+    @property
+    def directories(self) -> List[str]:
+        return self._directories
+
+    def command(self, seccomp_fd: Optional[int] = None) -> List[str]:
+        command = list(self._argv)
+
+        for env, value in self._env.items():
+            command.extend(["--setenv", env, value])
+
+        if seccomp_fd is not None:
+            command.extend(["--seccomp", str(seccomp_fd)])
+
+        command.append(self._executable)
+        return command
+
+    def to_dict(self) -> Dict:
+        return {
+            "key": self._key,
+            "argv": self._argv,
+            "env": self._env,
+            "executable": self._executable,
+            "seccomp_filter": self._seccomp_filter,
+            "dbus_app": self._dbus_app,
+            "dbus_permissions": self._dbus_permissions,
+            "directories": self._directories,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> Self:
+        return cls(**data)
+
+    def save(self, path: str) -> None:
+        temporary = f"{path}.{os.getpid()}.tmp"
+
+        with open(temporary, "w") as fp:
+            json.dump(self.to_dict(), fp)
+
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str, key: str) -> Optional[Self]:
+        try:
+            with open(path) as fp:
+                data = json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if data.get("key") != key:
+            return None
+
+        return cls.from_dict(data)
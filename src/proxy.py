@@ -0,0 +1,249 @@
+import os, time, fcntl
+from typing import Dict, List, Optional
+
+from src import DBUS_PROXY_IDLE_TIMEOUT
+from src.permissions import DBusPermissions, DBusPermissionList
+
+XDG_DBUS_PROXY = "/usr/bin/xdg-dbus-proxy"
+
+# How often an idle supervisor checks whether any sandbox still holds a lease
+POLL_INTERVAL = 2
+
+PORTAL_BUS = "org.freedesktop.portal.Desktop"
+PORTAL_PATH = "/org/freedesktop/portal/desktop"
+
+# What every app had through --talk before permissions, file dialogs and opening links
+# keep working without asking for anything
+BASE_PORTAL_INTERFACES = ["org.freedesktop.portal.FileChooser",
+                          "org.freedesktop.portal.OpenURI",
+                          "org.freedesktop.portal.Settings",
+                          "org.freedesktop.portal.Inhibit",
+                          "org.freedesktop.portal.NetworkMonitor",
+                          "org.freedesktop.portal.ProxyResolver",
+                          "org.freedesktop.portal.Email",
+                          "org.freedesktop.portal.Print",
+                          "org.freedesktop.portal.Trash"]
+
+# Portal interfaces every permission maps onto
+PORTAL_INTERFACES = {
+    DBusPermissionList.Notifications: ["org.freedesktop.portal.Notification"],
+    DBusPermissionList.Screencast: ["org.freedesktop.portal.ScreenCast",
+                                    "org.freedesktop.portal.Session"],
+    DBusPermissionList.Screenshot: ["org.freedesktop.portal.Screenshot"],
+}
+
+
+class XdgDbusProxy:
+
+    def __init__(self, app: str, permissions: DBusPermissions,
+                 environ: Optional[Dict[str, str]] = None) -> None:
+        self._app = app
+        self._permissions = permissions
+        self._environ = os.environ if environ is None else environ
+
+        self._xdg_runtime_dir = self._environ['XDG_RUNTIME_DIR']
+
+    @property
+    def socket_path(self) -> str:
+        return f"{self._xdg_runtime_dir}/xdg-dbus-proxy/{self._app}.sock"
+
+    def filters(self) -> List[str]:
+        filters = ["--filter", f"--own={self._app}", f"--own={self._app}.*"]
+
+        # Version lookups and the Response signal of every portal request
+        filters.append(f"--call={PORTAL_BUS}=org.freedesktop.DBus.Properties.*@{PORTAL_PATH}")
+        filters.append(f"--call={PORTAL_BUS}=org.freedesktop.portal.Request.*@{PORTAL_PATH}/request/*")
+        filters.append(f"--broadcast={PORTAL_BUS}=org.freedesktop.portal.*@{PORTAL_PATH}/*")
+
+        interfaces = list(BASE_PORTAL_INTERFACES)
+
+        for permission, permitted in PORTAL_INTERFACES.items():
+            if self._permissions.has_permission(permission):
+                interfaces.extend(permitted)
+
+        for interface in interfaces:
+            filters.append(f"--call={PORTAL_BUS}={interface}.*@{PORTAL_PATH}")
+            filters.append(f"--call={PORTAL_BUS}={interface}.*@{PORTAL_PATH}/*")
+
+        # libnotify talks to the notification daemon directly instead of the portal
+        if self._permissions.has_permission(DBusPermissionList.Notifications):
+            filters.append("--talk=org.freedesktop.Notifications")
+
+        return filters
+
+    def command(self) -> List[str]:
+        return [XDG_DBUS_PROXY, self._environ['DBUS_SESSION_BUS_ADDRESS'],
+                self.socket_path] + self.filters()
+
+
+class DBusProxyManager:
+
+    def __init__(self, app: str, permissions: DBusPermissions,
+                 idle_timeout: float = DBUS_PROXY_IDLE_TIMEOUT,
+                 environ: Optional[Dict[str, str]] = None) -> None:
+        self._proxy = XdgDbusProxy(app=app, permissions=permissions, environ=environ)
+        self._idle_timeout = idle_timeout
+        self._environ = os.environ if environ is None else environ
+
+        base = self._proxy.socket_path.removesuffix(".sock")
+        self._lease_path = f"{base}.lease"
+        self._start_path = f"{base}.start"
+        self._pid_path = f"{base}.pid"
+
+    @property
+    def socket_path(self) -> str:
+        return self._proxy.socket_path
+
+    def running(self) -> bool:
+        try:
+            with open(self._pid_path) as fp:
+                os.kill(int(fp.read()), 0)
+        except (FileNotFoundError, ValueError, ProcessLookupError):
+            return False
+
+        return os.path.exists(self.socket_path)
+
+    def acquire(self) -> int:
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+
+        # Every sandbox holds a shared lock, the supervisor only stops once it
+        # can take the lock exclusively
+        lease = os.open(self._lease_path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(lease, fcntl.LOCK_SH)
+
+        start = os.open(self._start_path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        try:
+            fcntl.flock(start, fcntl.LOCK_EX)
+
+            if not self.running():
+                self._spawn()
+        except BaseException:
+            os.close(lease)
+            raise
+        finally:
+            os.close(start)
+
+        return lease
+
+    def _spawn(self) -> None:
+        import sys, subprocess
+
+        # A fresh interpreter instead of a fork of this one. pharaohd runs launches on
+        # several threads, a forked child would inherit their lease and .start fds
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, **self._environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")]))
+
+        read_fd, write_fd = os.pipe()
+
+        try:
+            supervisor = subprocess.Popen(
+                [sys.executable, "-S", "-m", "src.proxy", str(write_fd), self.socket_path,
+                 self._lease_path, self._pid_path, str(self._idle_timeout),
+                 *self._proxy.command()],
+                pass_fds=(write_fd,), close_fds=True, start_new_session=True, env=env,
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+        finally:
+            os.close(write_fd)
+
+        # It forks once more and exits, the proxy's supervisor is never our child
+        supervisor.wait()
+
+        ready = os.read(read_fd, 1)
+        os.close(read_fd)
+
+        if not ready:
+            raise RuntimeError("xdg-dbus-proxy exited before it was ready")
+
+
+def launch_proxy(command: List[str], sync_fd: int) -> int:
+    pid = os.fork()
+
+    if not pid:
+        os.set_inheritable(sync_fd, True)
+
+        try:
+            # The proxy reports readiness on this fd and exits once the other end closes
+            os.execv(command[0], command[:3] + [f"--fd={sync_fd}"] + command[3:])
+        finally:
+            os._exit(127)
+
+    return pid
+
+
+def supervise(notify_fd: int, socket_path: str, lease_path: str, pid_path: str,
+              idle_timeout: float, command: List[str]) -> None:
+    # The proxy must not hold the launcher's end open
+    os.set_inheritable(notify_fd, False)
+
+    # A socket left behind by a crashed proxy would make the bind fail
+    if os.path.lexists(socket_path):
+        os.unlink(socket_path)
+
+    read_fd, write_fd = os.pipe()
+    proxy = launch_proxy(command, write_fd)
+    os.close(write_fd)
+
+    if not os.read(read_fd, 1):
+        return
+
+    with open(f"{pid_path}.tmp", "w") as fp:
+        fp.write(str(os.getpid()))
+
+    os.replace(f"{pid_path}.tmp", pid_path)
+
+    os.write(notify_fd, b"x")
+    os.close(notify_fd)
+
+    lease = os.open(lease_path, os.O_RDWR | os.O_CREAT, 0o600)
+    idle = None
+
+    while True:
+        time.sleep(POLL_INTERVAL)
+
+        if os.waitpid(proxy, os.WNOHANG)[0]:
+            proxy = None
+            break
+
+        try:
+            fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            idle = None
+            continue
+
+        idle = idle or time.monotonic()
+
+        # Keep the exclusive lock while shutting down, new launches wait
+        # for it and then start a fresh proxy
+        if time.monotonic() - idle >= idle_timeout:
+            break
+
+        fcntl.flock(lease, fcntl.LOCK_UN)
+
+    os.remove(pid_path)
+
+    if os.path.lexists(socket_path):
+        os.unlink(socket_path)
+
+    os.close(read_fd)
+
+    if proxy:
+        os.waitpid(proxy, 0)
+
+
+def main(args: List[str]) -> None:
+    notify_fd, socket_path, lease_path, pid_path, idle_timeout, *command = args
+
+    # Detach from whoever started us, they only wait for this process to exit
+    if os.fork():
+        os._exit(0)
+
+    supervise(int(notify_fd), socket_path, lease_path, pid_path, float(idle_timeout), command)
+
+
+if __name__ == "__main__":
+    import sys
+
+    main(sys.argv[1:])
@@ -0,0 +1,314 @@
+import re
+from collections import deque
+from typing import Callable, Dict, List, Optional, Self, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from src.database import SyncDatabase
+    from src.fetch import Package
+
+
+class ResolveError(Exception):
+    pass
+
+
+def _rpmvercmp(a: str, b: str) -> int:
+    if a == b:
+        return 0
+
+    i = j = 0
+
+    while i < len(a) and j < len(b):
+        start_a, start_b = i, j
+
+        while i < len(a) and not a[i].isalnum():
+            i += 1
+        while j < len(b) and not b[j].isalnum():
+            j += 1
+
+        if i >= len(a) or j >= len(b):
+            break
+
+        if (i - start_a) != (j - start_b):
+            return -1 if (i - start_a) < (j - start_b) else 1
+
+        is_digit = a[i].isdigit()
+        match = str.isdigit if is_digit else str.isalpha
+
+        end_a, end_b = i, j
+        while end_a < len(a) and match(a[end_a]):
+            end_a += 1
+        while end_b < len(b) and match(b[end_b]):
+            end_b += 1
+
+        segment_a, segment_b = a[i:end_a], b[j:end_b]
+
+        # Numeric segments are always newer than alpha segments
+        if not segment_b:
+            return 1 if is_digit else -1
+
+        if is_digit:
+            segment_a = segment_a.lstrip("0")
+            segment_b = segment_b.lstrip("0")
+
+            if len(segment_a) != len(segment_b):
+                return 1 if len(segment_a) > len(segment_b) else -1
+
+        if segment_a != segment_b:
+            return 1 if segment_a > segment_b else -1
+
+        i, j = end_a, end_b
+
+    if i >= len(a) and j >= len(b):
+        return 0
+
+    if (i >= len(a) and not b[j].isalpha()) or (i < len(a) and a[i].isalpha()):
+        return -1
+
+    return 1
+
+
+def _split_evr(version: str) -> Tuple[str, str, Optional[str]]:
+    epoch = "0"
+
+    if ":" in version:
+        head, tail = version.split(":", 1)
+        if head.isdigit():
+            epoch, version = head, tail
+
+    release = None
+    if "-" in version:
+        version, release = version.rsplit("-", 1)
+
+    return epoch, version, release
+
+
+def vercmp(a: str, b: str) -> int:
+    if a == b:
+        return 0
+
+    epoch_a, version_a, release_a = _split_evr(a)
+    epoch_b, version_b, release_b = _split_evr(b)
+
+    result = _rpmvercmp(epoch_a, epoch_b) or _rpmvercmp(version_a, version_b)
+
+    if not result and release_a and release_b:
+        result = _rpmvercmp(release_a, release_b)
+
+    return result
+
+
+class Dependency:
+
+    __slots__ = ("_name", "_op", "_version")
+
+    OPERATORS = {
+        "=": lambda r: r == 0,
+        ">=": lambda r: r >= 0,
+        "<=": lambda r: r <= 0,
+        ">": lambda r: r > 0,
+        "<": lambda r: r < 0,
+    }
+
+    def __init__(self, name: str, op: Optional[str] = None,
+                 version: Optional[str] = None) -> None:
+        self._name = name
+        self._op = op
+        self._version = version
+
+    def __str__(self) -> str:
+        return f"{self._name}{self._op}{self._version}" if self._op else self._name
+
+    def __repr__(self) -> str:
+        return f"Dependency({repr(str(self))})"
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def op(self) -> Optional[str]:
+        return self._op
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._version
+
+    @classmethod
+    def from_str(cls, value: str) -> Self:
+        # optdepends carry a description after the colon
+        value = value.split(": ", 1)[0].strip()
+        match = re.match(r"^([^<>=]+)(<=|>=|=|<|>)(.+)$", value)
+
+        if not match:
+            return cls(name=value)
+
+        return cls(name=match.group(1), op=match.group(2), version=match.group(3))
+
+    def version_matches(self, version: Optional[str]) -> bool:
+        if not self._op:
+            return True
+
+        if not version:
+            return False
+
+        return self.OPERATORS[self._op](vercmp(version, self._version))
+
+    def satisfied_by(self, package: "Package") -> bool:
+        if package.name == self._name and self.version_matches(package.version):
+            return True
+
+        for provide in package.provides:
+            provided = Dependency.from_str(provide)
+
+            if provided.name == self._name and self.version_matches(provided.version):
+                return True
+
+        return False
+
+
+class Plan:
+
+    def __init__(self, target: "Package", packages: List["Package"],
+                 missing: List[Dependency], cycles: List[List[str]]) -> None:
+        self._target = target
+        self._packages = packages
+        self._missing = missing
+        self._cycles = cycles
+
+    def __len__(self) -> int:
+        return len(self._packages)
+
+    @property
+    def target(self) -> "Package":
+        return self._target
+
+    @property
+    def packages(self) -> List["Package"]:
+        return self._packages
+
+    @property
+    def missing(self) -> List[Dependency]:
+        return self._missing
+
+    @property
+    def cycles(self) -> List[List[str]]:
+        return self._cycles
+
+    @property
+    def download_size(self) -> int:
+        return sum(package.csize for package in self._packages)
+
+    def print(self) -> None:
+        print(f"Packages ({len(self._packages)}):")
+
+        for package in self._packages:
+            print(f"  {package.repo}/{package.name} {package.version}")
+
+        for cycle in self._cycles:
+            print(f"Warning: dependency cycle {' -> '.join(cycle)}")
+
+        for depend in self._missing:
+            print(f"Warning: unable to satisfy dependency '{depend}'")
+
+        print(f"Total download size: {self.download_size / (1024 * 1024):.2f} MiB")
+
+
+class Resolver:
+
+    def __init__(self, database: "SyncDatabase",
+                 is_installed: Callable[[Dependency], bool]) -> None:
+        self._database = database
+        self._is_installed = is_installed
+
+    def resolve(self, target: "Package",
+                extra: Optional[List["Package"]] = None) -> Plan:
+        selected = {target.name: target}
+        edges = {target.name: []}
+        missing = []
+
+        queue = deque([target] + list(extra or []))
+        for package in extra or []:
+            selected.setdefault(package.name, package)
+            edges.setdefault(package.name, [])
+
+        while queue:
+            package = queue.popleft()
+
+            for depend in map(Dependency.from_str, package.depends):
+                providers = self._providers(depend)
+
+                # Anything already in the plan wins over the host and the repos
+                provider = next((candidate for candidate in providers
+                                 if selected.get(candidate.name) is candidate), None)
+
+                if not provider:
+                    if self._is_installed(depend):
+                        continue
+
+                    if not providers:
+                        missing.append(depend)
+                        continue
+
+                    provider = providers[0]
+                    selected[provider.name] = provider
+                    edges[provider.name] = []
+                    queue.append(provider)
+
+                if provider is not package:
+                    edges[package.name].append(provider.name)
+
+        self._check_conflicts(selected)
+        order, cycles = self._sort(target.name, edges)
+
+        return Plan(target=target,
+                    packages=[selected[name] for name in order],
+                    missing=missing,
+                    cycles=cycles)
+
+    def _providers(self, depend: Dependency) -> List["Package"]:
+        return [
+            package for package in self._database.providers(depend.name)
+            if depend.satisfied_by(package)
+        ]
+
+    def _check_conflicts(self, selected: Dict[str, "Package"]) -> None:
+        for package in selected.values():
+            for conflict in map(Dependency.from_str, package.conflicts):
+                for other in self._database.providers(conflict.name):
+                    if (selected.get(other.name) is other and other is not package
+                            and conflict.satisfied_by(other)):
+                        raise ResolveError(
+                            f"{package.name} conflicts with {other.name} ({conflict})")
+
+    def _sort(self, root: str,
+              edges: Dict[str, List[str]]) -> Tuple[List[str], List[List[str]]]:
+        # Depth first post-order so dependencies always precede their dependents.
+        # Back edges are cycles, they get reported and broken like pacman does.
+        order, cycles = [], []
+        state = {}
+
+        for start in [root] + list(edges):
+            if start in state:
+                continue
+
+            stack = [(start, iter(edges[start]))]
+            path = [start]
+            state[start] = 1
+
+            while stack:
+                name, children = stack[-1]
+                child = next(children, None)
+
+                if child is None:
+                    stack.pop()
+                    path.pop()
+                    state[name] = 2
+                    order.append(name)
+                elif child not in state:
+                    state[child] = 1
+                    path.append(child)
+                    stack.append((child, iter(edges[child])))
+                elif state[child] == 1:
+                    cycles.append(path[path.index(child):] + [child])
+
+        return order, cycles
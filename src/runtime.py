@@ -0,0 +1,68 @@
+import os, shutil
+from typing import List, TYPE_CHECKING
+
+from src import RUNTIME_DIRECTORY
+from src.database import LocalDatabase, write_desc
+
+if TYPE_CHECKING:
+    from src.fetch import Package
+    from src.resolve import Dependency
+
+
+class Runtime:
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._path = f"{RUNTIME_DIRECTORY}{name}"
+        self._database = None
+
+    def __repr__(self) -> str:
+        return f"Runtime(name={repr(self._name)})"
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def ref(self) -> str:
+        return f"runtime:{self._name}"
+
+    @property
+    def database_path(self) -> str:
+        # Kept outside of usr/ so it never shows up in the sandbox overlays
+        return f"{self._path}/.pharaoh/local"
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.database_path)
+
+    def satisfies(self, depend: "Dependency") -> bool:
+        if self._database is None:
+            self._database = LocalDatabase(self.database_path)
+
+        return self._database.satisfies(depend)
+
+    def record(self, packages: List["Package"]) -> None:
+        shutil.rmtree(self.database_path, ignore_errors=True)
+
+        for package in packages:
+            path = f"{self.database_path}/{package.name}-{package.version}"
+            os.makedirs(path, exist_ok=True)
+            write_desc(f"{path}/desc", package.to_desc())
+
+        self._database = None
+
+    def remove(self) -> None:
+        shutil.rmtree(self._path)
+
+    @classmethod
+    def list(cls) -> List["Runtime"]:
+        try:
+            names = sorted(os.listdir(RUNTIME_DIRECTORY))
+        except FileNotFoundError:
+            return []
+
+        return [runtime for runtime in map(cls, names) if runtime.exists()]
@@ -0,0 +1,391 @@
+import os, json, errno, struct, hashlib
+from typing import Dict, List, Optional, Self, Tuple, Union
+
+from src import SECCOMP_DIRECTORY
+from src.syscalls import SYSCALLS
+
+# Bump whenever the generated program changes for the same policy
+SECCOMP_VERSION = 1
+
+AUDIT_ARCH_X86_64 = 0xc000003e
+X32_SYSCALL_BIT = 0x40000000
+
+BPF_LD_W_ABS = 0x20
+BPF_ALU_AND_K = 0x54
+BPF_JMP_JEQ_K = 0x15
+BPF_JMP_JGT_K = 0x25
+BPF_JMP_JGE_K = 0x35
+BPF_RET_K = 0x06
+
+# Offsets into struct seccomp_data
+SECCOMP_DATA_NR = 0
+SECCOMP_DATA_ARCH = 4
+SECCOMP_DATA_ARGS = 16
+
+RETURN_ACTIONS = {
+    "kill": 0x80000000,
+    "trap": 0x00030000,
+    "errno": 0x00050000,
+    "log": 0x7ffc0000,
+    "allow": 0x7fff0000,
+}
+
+OPERATORS = ("eq", "ne", "gt", "ge", "lt", "le", "masked_eq")
+
+# Checked first, in this order, a GUI app spends most of its syscalls here
+HOT_SYSCALLS = [
+    "futex", "read", "write", "recvmsg", "poll", "ppoll", "epoll_wait", "sendmsg",
+    "writev", "mmap", "munmap", "mprotect", "madvise", "close", "openat", "newfstatat",
+    "fstat", "statx", "ioctl", "lseek", "pread64", "getdents64", "fcntl", "readv",
+    "recvfrom", "sendto", "sched_yield", "rt_sigprocmask", "getpid", "gettid", "brk",
+]
+
+CLONE_NEWUSER = 0x10000000
+TIOCSTI = 0x5412
+TIOCLINUX = 0x541c
+AF_INET = 2
+AF_INET6 = 10
+
+PRESETS = {
+    "default": {
+        "deny": [
+            "syslog", "uselib", "acct", "quotactl", "add_key", "keyctl", "request_key",
+            "move_pages", "mbind", "get_mempolicy", "set_mempolicy", "migrate_pages",
+            "unshare", "setns", "mount", "umount2", "pivot_root", "chroot", "kexec_load",
+            "kexec_file_load", "init_module", "finit_module", "delete_module", "bpf",
+            "perf_event_open", "userfaultfd", "open_by_handle_at", "name_to_handle_at",
+            "lookup_dcookie", "vhangup", "swapon", "swapoff", "reboot", "settimeofday",
+            "clock_settime", "clock_adjtime", "adjtimex", "iopl", "ioperm", "modify_ldt",
+            "ptrace", "process_vm_readv", "process_vm_writev", "fsopen", "fsconfig",
+            "fsmount", "fspick", "open_tree", "move_mount", "mount_setattr",
+        ],
+        "rules": [
+            # No flags to inspect behind the struct pointer, make glibc fall back to clone
+            {"syscall": "clone3", "action": "errno:ENOSYS", "args": []},
+            {"syscall": "clone", "action": "errno",
+             "args": [{"index": 0, "op": "masked_eq", "mask": CLONE_NEWUSER, "value": CLONE_NEWUSER}]},
+            # Pushing input into the controlling terminal escapes the sandbox
+            {"syscall": "ioctl", "action": "errno",
+             "args": [{"index": 1, "op": "masked_eq", "mask": 0xffffffff, "value": TIOCSTI}]},
+            {"syscall": "ioctl", "action": "errno",
+             "args": [{"index": 1, "op": "masked_eq", "mask": 0xffffffff, "value": TIOCLINUX}]},
+        ],
+    },
+    "devel": {
+        "allow": ["ptrace", "perf_event_open", "process_vm_readv", "process_vm_writev"],
+    },
+    "no-network": {
+        "rules": [
+            {"syscall": "socket", "action": "errno:EAFNOSUPPORT",
+             "args": [{"index": 0, "op": "eq", "value": AF_INET}]},
+            {"syscall": "socket", "action": "errno:EAFNOSUPPORT",
+             "args": [{"index": 0, "op": "eq", "value": AF_INET6}]},
+        ],
+    },
+}
+
+
+def return_value(action: str) -> int:
+    name, _, argument = action.partition(":")
+
+    if name not in RETURN_ACTIONS:
+        raise ValueError(f"Unknown seccomp action '{action}'")
+
+    if name != "errno":
+        return RETURN_ACTIONS[name]
+
+    code = errno.EPERM
+
+    if argument:
+        code = int(argument) if argument.isdigit() else getattr(errno, argument, None)
+
+        if code is None:
+            raise ValueError(f"Unknown errno '{argument}'")
+
+    return RETURN_ACTIONS["errno"] | (code & 0xffff)
+
+
+class ArgumentRule:
+
+    def __init__(self, syscall: str, action: str, args: List[Dict]) -> None:
+        if syscall not in SYSCALLS:
+            raise ValueError(f"Unknown syscall '{syscall}'")
+
+        for arg in args:
+            if arg["op"] not in OPERATORS:
+                raise ValueError(f"Unknown operator '{arg['op']}'")
+
+            if arg["op"] == "masked_eq" and "mask" not in arg:
+                raise ValueError("masked_eq needs a mask")
+
+            if not 0 <= arg["index"] < 6:
+                raise ValueError(f"Syscall argument index out of range: {arg['index']}")
+
+        return_value(action)
+
+        self._syscall = syscall
+        self._action = action
+        self._args = args
+
+    @property
+    def syscall(self) -> str:
+        return self._syscall
+
+    @property
+    def action(self) -> str:
+        return self._action
+
+    @property
+    def args(self) -> List[Dict]:
+        return self._args
+
+    def to_dict(self) -> Dict:
+        return {"syscall": self._syscall, "action": self._action, "args": self._args}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> Self:
+        return cls(syscall=data["syscall"], action=data["action"],
+                   args=data.get("args", []))
+
+
+class Assembler:
+
+    def __init__(self) -> None:
+        self._program: List[Tuple[int, Union[int, str], Union[int, str], int]] = []
+        self._labels: Dict[str, int] = {}
+        self._counter = 0
+
+    def __len__(self) -> int:
+        return len(self._program)
+
+    def label(self) -> str:
+        self._counter += 1
+        return f"L{self._counter}"
+
+    def place(self, label: str) -> None:
+        self._labels[label] = len(self._program)
+
+    def load(self, offset: int) -> None:
+        self._program.append((BPF_LD_W_ABS, 0, 0, offset))
+
+    def mask(self, value: int) -> None:
+        self._program.append((BPF_ALU_AND_K, 0, 0, value))
+
+    def jump(self, code: int, value: int, jt: Union[int, str] = 0,
+             jf: Union[int, str] = 0) -> None:
+        self._program.append((code, jt, jf, value))
+
+    def ret(self, value: int) -> None:
+        self._program.append((BPF_RET_K, 0, 0, value))
+
+    def _offset(self, pc: int, target: Union[int, str]) -> int:
+        if isinstance(target, int):
+            return target
+
+        offset = self._labels[target] - pc - 1
+
+        # Conditional jumps only reach 255 instructions ahead
+        if not 0 <= offset <= 255:
+            raise ValueError(f"BPF jump out of range: {offset}")
+
+        return offset
+
+    def assemble(self) -> bytes:
+        return b"".join(
+            struct.pack("<HBBI", code, self._offset(pc, jt), self._offset(pc, jf), k)
+            for pc, (code, jt, jf, k) in enumerate(self._program))
+
+
+class SeccompPolicy:
+
+    def __init__(self, default: str = "allow", deny_action: str = "errno",
+                 actions: Optional[Dict[str, str]] = None,
+                 rules: Optional[List[ArgumentRule]] = None) -> None:
+        return_value(default)
+        return_value(deny_action)
+
+        self._default = default
+        self._deny_action = deny_action
+        self._actions = actions or {}
+        self._rules = rules or []
+
+    @property
+    def default(self) -> str:
+        return self._default
+
+    @property
+    def rules(self) -> List[ArgumentRule]:
+        return self._rules
+
+    def action(self, syscall: str) -> str:
+        action = self._actions.get(syscall, self._default)
+        return self._deny_action if action == "deny" else action
+
+    def _apply(self, data: Dict) -> None:
+        for name in data.get("presets", []):
+            if name not in PRESETS:
+                raise ValueError(f"Unknown seccomp preset '{name}'")
+
+            self._apply(PRESETS[name])
+
+        self._default = data.get("default", self._default)
+        self._deny_action = data.get("deny_action", self._deny_action)
+
+        for syscall in data.get("deny", []):
+            if syscall not in SYSCALLS:
+                raise ValueError(f"Unknown syscall '{syscall}'")
+
+            self._actions[syscall] = "deny"
+
+        # An explicit allow also drops the argument rules an earlier preset added
+        for syscall in data.get("allow", []):
+            if syscall not in SYSCALLS:
+                raise ValueError(f"Unknown syscall '{syscall}'")
+
+            self._actions[syscall] = "allow"
+            self._rules = [rule for rule in self._rules if rule.syscall != syscall]
+
+        self._rules.extend(ArgumentRule.from_dict(rule) for rule in data.get("rules", []))
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> Self:
+        policy = cls()
+        policy._apply(data)
+
+        return_value(policy._default)
+        return_value(policy._deny_action)
+        return policy
+
+    def to_dict(self) -> Dict:
+        return {
+            "default": self._default,
+            "deny_action": self._deny_action,
+            "actions": dict(sorted(self._actions.items())),
+            "rules": [rule.to_dict() for rule in self._rules],
+        }
+
+    @property
+    def hash(self) -> str:
+        data = {"version": SECCOMP_VERSION, "policy": self.to_dict()}
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def _syscalls(self) -> List[str]:
+        explicit = set(rule.syscall for rule in self._rules)
+        explicit.update(name for name in self._actions if self.action(name) != self._default)
+
+        hot = [name for name in HOT_SYSCALLS if name in SYSCALLS]
+        cold = sorted(explicit.difference(hot), key=lambda name: SYSCALLS[name])
+
+        # Hot syscalls get a check even when they take the default, that way they
+        # never walk past the whole deny list
+        return hot + cold
+
+    def _compile_condition(self, asm: Assembler, arg: Dict, fail: str) -> None:
+        value = arg["value"] & 0xffffffffffffffff
+        high, low = value >> 32, value & 0xffffffff
+
+        offset = SECCOMP_DATA_ARGS + 8 * arg["index"]
+        success = asm.label()
+
+        match arg["op"]:
+            case "eq":
+                asm.load(offset + 4)
+                asm.jump(BPF_JMP_JEQ_K, high, 0, fail)
+                asm.load(offset)
+                asm.jump(BPF_JMP_JEQ_K, low, 0, fail)
+            case "masked_eq":
+                mask = arg["mask"] & 0xffffffffffffffff
+                asm.load(offset + 4)
+                asm.mask(mask >> 32)
+                asm.jump(BPF_JMP_JEQ_K, high & (mask >> 32), 0, fail)
+                asm.load(offset)
+                asm.mask(mask & 0xffffffff)
+                asm.jump(BPF_JMP_JEQ_K, low & mask, 0, fail)
+            case "ne":
+                asm.load(offset + 4)
+                asm.jump(BPF_JMP_JEQ_K, high, 0, success)
+                asm.load(offset)
+                asm.jump(BPF_JMP_JEQ_K, low, fail, 0)
+            case "gt" | "ge":
+                asm.load(offset + 4)
+                asm.jump(BPF_JMP_JGT_K, high, success, 0)
+                asm.jump(BPF_JMP_JEQ_K, high, 0, fail)
+                asm.load(offset)
+                asm.jump(BPF_JMP_JGT_K if arg["op"] == "gt" else BPF_JMP_JGE_K, low, 0, fail)
+            case "lt" | "le":
+                asm.load(offset + 4)
+                asm.jump(BPF_JMP_JGT_K, high, fail, 0)
+                asm.jump(BPF_JMP_JEQ_K, high, 0, success)
+                asm.load(offset)
+                asm.jump(BPF_JMP_JGT_K if arg["op"] == "le" else BPF_JMP_JGE_K, low, fail, 0)
+
+        asm.place(success)
+
+    def compile(self) -> bytes:
+        asm = Assembler()
+        default = return_value(self._default)
+
+        asm.load(SECCOMP_DATA_ARCH)
+        asm.jump(BPF_JMP_JEQ_K, AUDIT_ARCH_X86_64, 1, 0)
+        asm.ret(RETURN_ACTIONS["kill"])
+
+        # The x32 ABI reuses the x86_64 audit arch with different numbers
+        asm.load(SECCOMP_DATA_NR)
+        asm.jump(BPF_JMP_JGE_K, X32_SYSCALL_BIT, 0, 1)
+        asm.ret(return_value("errno:ENOSYS"))
+
+        rules = {}
+        for rule in self._rules:
+            rules.setdefault(rule.syscall, []).append(rule)
+
+        for syscall in self._syscalls():
+            skip = asm.label()
+            asm.jump(BPF_JMP_JEQ_K, SYSCALLS[syscall], 0, skip)
+
+            # First matching rule wins, the accumulator no longer holds the nr
+            for rule in rules.get(syscall, []):
+                next_rule = asm.label()
+
+                for arg in rule.args:
+                    self._compile_condition(asm, arg, next_rule)
+
+                asm.ret(return_value(rule.action))
+                asm.place(next_rule)
+
+            asm.ret(return_value(self.action(syscall)))
+            asm.place(skip)
+
+        asm.ret(default)
+        return asm.assemble()
+
+
+class SeccompCache:
+
+    def __init__(self, paths: Optional[List[str]] = None) -> None:
+        # Filters compiled at install time are shared, users compile their own
+        # edits into the runtime directory
+        self._paths = paths or [SECCOMP_DIRECTORY,
+                                f"{os.environ.get('XDG_RUNTIME_DIR', '/tmp')}/pharaoh/seccomp"]
+
+    def get(self, policy: SeccompPolicy) -> str:
+        name = f"{policy.hash}.bpf"
+
+        for path in self._paths:
+            if os.path.exists(f"{path}/{name}"):
+                return f"{path}/{name}"
+
+        program = policy.compile()
+
+        for path in self._paths:
+            try:
+                os.makedirs(path, exist_ok=True)
+
+                with open(f"{path}/{name}.{os.getpid()}.tmp", "wb") as fp:
+                    fp.write(program)
+
+                os.replace(f"{path}/{name}.{os.getpid()}.tmp", f"{path}/{name}")
+                return f"{path}/{name}"
+            except PermissionError:
+                continue
+
+        raise PermissionError(f"No writable directory for seccomp filter {name}")
@@ -0,0 +1,169 @@
+import os, time, sqlite3
+from typing import Dict, Iterable, List, Optional, Set, TYPE_CHECKING
+
+from src import STATE_DATABASE
+
+if TYPE_CHECKING:
+    from src.fetch import Package
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS apps (
+    name TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    target TEXT NOT NULL,
+    runtimes TEXT NOT NULL,
+    installed REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS packages (
+    app TEXT NOT NULL REFERENCES apps (name) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    repo TEXT,
+    filename TEXT,
+    sha256sum TEXT,
+    csize INTEGER NOT NULL,
+    PRIMARY KEY (app, name)
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    app TEXT NOT NULL,
+    package TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (app, package, path),
+    FOREIGN KEY (app, package) REFERENCES packages (app, name) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+
+CREATE TABLE IF NOT EXISTS exports (
+    app TEXT NOT NULL REFERENCES apps (name) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    PRIMARY KEY (app, path)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS exports_path ON exports (path);
+"""
+
+
+class StateError(Exception):
+    pass
+
+
+class StateDatabase:
+
+    def __init__(self, path: str = STATE_DATABASE, readonly: bool = False) -> None:
+        self._path = path
+
+        try:
+            if readonly:
+                # Queries work for every user and never create an empty database
+                self._connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._connection = sqlite3.connect(path)
+        except sqlite3.OperationalError as e:
+            raise StateError(f"Failed to open '{path}': {e}")
+
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA foreign_keys = ON")
+
+        if not readonly:
+            self._migrate()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _migrate(self) -> None:
+        version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+
+        if version > SCHEMA_VERSION:
+            raise StateError(f"'{self._path}' is from a newer pharaoh (schema {version})")
+
+        if version < SCHEMA_VERSION:
+            with self._connection:
+                self._connection.executescript(SCHEMA)
+                self._connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def record(self, app: str, path: str, target: "Package", packages: List["Package"],
+               files: Dict[str, List[str]], exports: Iterable[str],
+               runtimes: List[str]) -> None:
+        # All or nothing, a failed install never leaves half an app behind
+        with self._connection:
+            self._connection.execute("DELETE FROM apps WHERE name = ?", (app,))
+            self._connection.execute(
+                "INSERT INTO apps (name, path, target, runtimes, installed) VALUES (?, ?, ?, ?, ?)",
+                (app, path, target.name, ",".join(runtimes), time.time()))
+
+            self._connection.executemany(
+                "INSERT INTO packages (app, name, version, repo, filename, sha256sum, csize) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(app, package.name, package.version, package.repo, package.filename,
+                  package.sha256sum, package.csize) for package in packages])
+
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO files (app, package, path) VALUES (?, ?, ?)",
+                [(app, package, name) for package, names in files.items() for name in names])
+
+            self._connection.executemany(
+                "INSERT INTO exports (app, path) VALUES (?, ?)",
+                [(app, name) for name in exports])
+
+    def remove(self, app: str) -> bool:
+        with self._connection:
+            cursor = self._connection.execute("DELETE FROM apps WHERE name = ?", (app,))
+
+        return cursor.rowcount > 0
+
+    def apps(self) -> List[sqlite3.Row]:
+        return self._connection.execute(
+            "SELECT apps.*, packages.version AS version, "
+            "(SELECT COUNT(*) FROM packages WHERE packages.app = apps.name) AS packages "
+            "FROM apps JOIN packages ON packages.app = apps.name AND packages.name = apps.target "
+            "ORDER BY apps.name").fetchall()
+
+    def app(self, app: str) -> Optional[sqlite3.Row]:
+        return self._connection.execute(
+            "SELECT * FROM apps WHERE name = ?", (app,)).fetchone()
+
+    def packages(self, app: str) -> List[sqlite3.Row]:
+        return self._connection.execute(
+            "SELECT packages.*, COUNT(files.path) AS files FROM packages "
+            "LEFT JOIN files ON files.app = packages.app AND files.package = packages.name "
+            "WHERE packages.app = ? GROUP BY packages.name ORDER BY packages.name",
+            (app,)).fetchall()
+
+    def files(self, app: str) -> Dict[str, List[str]]:
+        files = {}
+
+        for row in self._connection.execute(
+                "SELECT package, path FROM files WHERE app = ?", (app,)):
+            files.setdefault(row["package"], []).append(row["path"])
+
+        return files
+
+    def exports(self, app: str) -> Set[str]:
+        return {row["path"] for row in self._connection.execute(
+            "SELECT path FROM exports WHERE app = ?", (app,))}
+
+    def owners(self, path: str, app: Optional[str] = None) -> List[sqlite3.Row]:
+        query = ("SELECT files.app, files.package, packages.version FROM files "
+                 "JOIN packages ON packages.app = files.app AND packages.name = files.package "
+                 "WHERE files.path = ?")
+        args = [path]
+
+        if app:
+            query += " AND files.app = ?"
+            args.append(app)
+
+        return self._connection.execute(query + " ORDER BY files.app", args).fetchall()
+
+    def exporters(self, path: str) -> List[str]:
+        return [row["app"] for row in self._connection.execute(
+            "SELECT app FROM exports WHERE path = ?", (path,))]
@@ -0,0 +1,155 @@
+import os, stat, fcntl, shutil, hashlib
+from typing import Dict, Set, Tuple
+
+from src import STORE_DIRECTORY, DEDUP_METHOD
+
+# ioctl(2) request that shares the extents of one file with another (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+class ObjectStore:
+
+    def __init__(self, path: str = STORE_DIRECTORY,
+                 method: str = DEDUP_METHOD) -> None:
+        if method not in ("hardlink", "reflink"):
+            raise ValueError(f"Unknown deduplication method '{method}'")
+
+        self._path = path
+        self._method = method
+
+        self._objects = f"{path}/objects"
+        self._refs = f"{path}/refs"
+
+        os.makedirs(self._objects, exist_ok=True)
+        os.makedirs(self._refs, exist_ok=True)
+
+    def _object_path(self, key: str) -> str:
+        return f"{self._objects}/{key[:2]}/{key}"
+
+    def _key(self, path: str, st: os.stat_result) -> str:
+        with open(path, "rb") as fp:
+            digest = hashlib.file_digest(fp, "sha256").hexdigest()
+
+        # Linked files share their inode, so the metadata is part of the identity
+        return f"{digest}.{stat.S_IMODE(st.st_mode):o}.{st.st_uid}.{st.st_gid}"
+
+    def _clone(self, source: str, target: str) -> None:
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+        shutil.copystat(source, target)
+        os.chown(target, os.stat(source).st_uid, os.stat(source).st_gid)
+
+    def _link(self, source: str, target: str) -> None:
+        if self._method == "reflink":
+            self._clone(source, target)
+        else:
+            os.link(source, target)
+
+    def _replace(self, source: str, target: str) -> None:
+        # Link next to the target and rename over it, the tree is never missing a file
+        temporary = f"{target}.pharaoh-dedup"
+        self._link(source, temporary)
+        os.replace(temporary, target)
+
+    def _is_linked(self, st: os.stat_result, object_st: os.stat_result) -> bool:
+        if self._method == "reflink":
+            return (st.st_size == object_st.st_size
+                    and st.st_mtime_ns == object_st.st_mtime_ns)
+
+        return (st.st_dev, st.st_ino) == (object_st.st_dev, object_st.st_ino)
+
+    def deduplicate(self, app: str, app_dir: str) -> Tuple[int, int]:
+        refs = set()
+        keys = {}
+        linked = saved = 0
+
+        for root, dirs, files in os.walk(app_dir):
+            # Files next to usr/ are pharaoh's own bookkeeping and get rewritten in place
+            if root == app_dir:
+                dirs[:] = [name for name in dirs if not name.startswith(".")]
+                continue
+
+            for name in files:
+                path = f"{root}/{name}"
+                st = os.lstat(path)
+
+                if not stat.S_ISREG(st.st_mode) or not st.st_size:
+                    continue
+
+                # Hardlinks inside the tree only need to be hashed once
+                inode = (st.st_dev, st.st_ino)
+                key = keys.get(inode) or self._key(path, st)
+                keys[inode] = key
+                refs.add(key)
+
+                object_path = self._object_path(key)
+
+                try:
+                    object_st = os.stat(object_path)
+                except FileNotFoundError:
+                    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                    self._link(path, object_path)
+                    continue
+
+                if self._is_linked(st, object_st):
+                    continue
+
+                try:
+                    self._replace(object_path, path)
+                except OSError:
+                    # EMLINK, EXDEV or no reflink support, keep the private copy
+                    continue
+
+                linked += 1
+                saved += st.st_size
+
+        self._write_refs(app, refs)
+        return linked, saved
+
+    def release(self, app: str) -> int:
+        try:
+            os.remove(f"{self._refs}/{app}")
+        except FileNotFoundError:
+            pass
+
+        return self.collect()
+
+    def references(self) -> Dict[str, int]:
+        counts = {}
+
+        for app in os.listdir(self._refs):
+            if app.endswith(".tmp"):
+                continue
+
+            for key in self._read_refs(app):
+                counts[key] = counts.get(key, 0) + 1
+
+        return counts
+
+    def collect(self) -> int:
+        counts = self.references()
+        freed = 0
+
+        for root, dirs, files in os.walk(self._objects):
+            for key in files:
+                if counts.get(key):
+                    continue
+
+                path = f"{root}/{key}"
+                freed += os.lstat(path).st_size
+                os.remove(path)
+
+        return freed
+
+    def _read_refs(self, app: str) -> Set[str]:
+        with open(f"{self._refs}/{app}") as fp:
+            return set(line.strip() for line in fp if line.strip())
+
+    def _write_refs(self, app: str, refs: Set[str]) -> None:
+        path = f"{self._refs}/{app}"
+
+        with open(f"{path}.tmp", "w") as fp:
+            fp.write("\n".join(sorted(refs)))
+
+        os.replace(f"{path}.tmp", path)
@@ -11,6 +11,9 @@ rm -rf /etc/pharaoh
 echo "Removing pharaoh.sh from /etc/profile.d"
 rm /etc/profile.d/pharaoh.sh
 
+echo "Removing pharaohd.service from /usr/lib/systemd/user"
+rm /usr/lib/systemd/user/pharaohd.service
+
 echo "Removing symlink of the pharaoh binary"
 rm /usr/bin/pharaoh
 